@@ -0,0 +1,146 @@
+"""
+
+Benchmarks
+==========
+
+Standard workloads to measure the runtime, run from the command line
+with::
+
+    $ python3 -m tartpy.bench [scenario ...] [--scale 0.1]
+                              [--output results.json]
+                              [--save-baseline baseline.json]
+                              [--baseline baseline.json]
+
+Each scenario (see `scenarios`) runs in a fresh process, so the event
+loop and the runtimes start clean and the peak resident memory belongs
+to the scenario alone.  The report is a JSON object with, for each
+scenario, the messages per second, the latency percentiles of its unit
+of work in milliseconds and the peak RSS in kilobytes.
+
+With ``--baseline``, the results are compared against a report saved
+earlier, and the command fails if any scenario regressed by more than
+``--tolerance``.
+
+Exports
+-------
+
+- ``run``: run a scenario in a subprocess and summarize it
+- ``compare``: find regressions against a baseline
+- ``ScenarioFailed``: raised when a scenario process dies
+
+"""
+
+import multiprocessing
+import queue as queue_module
+import resource
+import sys
+
+from .scenarios import SCENARIOS
+
+PERCENTILES = (50, 90, 99)
+
+# seconds between checks that the scenario process is alive
+POLL_INTERVAL = 1
+
+
+class ScenarioFailed(Exception):
+    """The process of a scenario exited without a result."""
+
+
+def _child(name, params, queue):
+    f, defaults = SCENARIOS[name]
+    result = f(**params)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024  # bytes
+    result['peak_rss_kb'] = rss
+    queue.put(result)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def params_for(name, scale=1):
+    f, defaults = SCENARIOS[name]
+    return {key: max(1, int(value * scale))
+            for key, value in defaults.items()}
+
+
+def run(name, scale=1):
+    """Run scenario `name` in a fresh process and summarize it."""
+    params = params_for(name, scale)
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_child, args=(name, params, queue))
+    process.start()
+    try:
+        result = _result(name, process, queue)
+    finally:
+        process.join()
+    latencies = result.pop('latencies')
+    summary = {'params': params,
+               'messages': result.pop('messages'),
+               'seconds': result.pop('seconds'),
+               'peak_rss_kb': result.pop('peak_rss_kb')}
+    summary['msgs_per_sec'] = summary['messages'] / summary['seconds']
+    summary['latency_ms'] = (
+        {'p{}'.format(p): percentile(latencies, p) * 1000
+         for p in PERCENTILES} if latencies else None)
+    summary.update(result)
+    return summary
+
+
+def _result(name, process, queue):
+    while True:
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except queue_module.Empty:
+            if process.is_alive():
+                continue
+        # the result may have been sent just before exiting
+        try:
+            return queue.get(timeout=POLL_INTERVAL)
+        except queue_module.Empty:
+            process.join()
+            raise ScenarioFailed('scenario {} exited with code {}'
+                                 .format(name, process.exitcode)) from None
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Return the regressions of `results` with respect to `baseline`.
+
+    A regression is a drop of messages per second, or a growth of the
+    99th percentile latency or of the peak RSS, larger than
+    `tolerance` (a fraction).
+
+    """
+    regressions = []
+
+    def check(name, metric, current, previous, higher_is_better):
+        if current is None or previous is None:
+            return
+        if higher_is_better:
+            worse = current < previous * (1 - tolerance)
+        else:
+            worse = current > previous * (1 + tolerance)
+        if worse:
+            regressions.append({'scenario': name,
+                                'metric': metric,
+                                'baseline': previous,
+                                'current': current})
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        previous = baseline[name]
+        check(name, 'msgs_per_sec', result['msgs_per_sec'],
+              previous['msgs_per_sec'], True)
+        check(name, 'latency_ms.p99',
+              (result['latency_ms'] or {}).get('p99'),
+              (previous['latency_ms'] or {}).get('p99'), False)
+        check(name, 'peak_rss_kb', result['peak_rss_kb'],
+              previous['peak_rss_kb'], False)
+    return regressions
@@ -0,0 +1,62 @@
+import argparse
+import json
+import sys
+
+from . import run, compare, ScenarioFailed
+from .scenarios import SCENARIOS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python3 -m tartpy.bench',
+        description='Run the tartpy benchmark scenarios.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help='scenarios to run (default: all of {})'
+                        .format(', '.join(sorted(SCENARIOS))))
+    parser.add_argument('--scale', type=float, default=1,
+                        help='multiply the size of every scenario')
+    parser.add_argument('--output', help='write the report to this file')
+    parser.add_argument('--save-baseline',
+                        help='save the report as a baseline')
+    parser.add_argument('--baseline', help='compare with this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed regression, as a fraction '
+                        '(default: 0.1)')
+    args = parser.parse_args(argv)
+
+    names = args.scenarios or sorted(SCENARIOS)
+    for name in names:
+        if name not in SCENARIOS:
+            parser.error("unknown scenario '{}'".format(name))
+
+    results = {}
+    failed = []
+    for name in names:
+        print('running {}...'.format(name), file=sys.stderr)
+        try:
+            results[name] = run(name, args.scale)
+        except ScenarioFailed as exc:
+            print('error: {}'.format(exc), file=sys.stderr)
+            failed.append(name)
+
+    report = {'results': results}
+    if failed:
+        report['failed'] = failed
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        report['regressions'] = compare(results, baseline, args.tolerance)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'results': results}, f, indent=2, sort_keys=True)
+    return 1 if failed or report.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""
+
+Benchmark scenarios
+===================
+
+Every scenario runs a workload to completion in the current process
+and returns a dictionary with:
+
+- ``messages``: number of messages delivered,
+- ``seconds``: time spent delivering them,
+- ``latencies``: durations in seconds of each unit of work (a lap of
+  the ring, a round trip, ...), possibly empty,
+
+plus any scenario specific value.
+
+Register a scenario with the `scenario` decorator, giving the default
+value of its parameters.
+
+"""
+
+import socket
+import threading
+import time
+
+from ..eventloop import EventLoop
+from ..runtime import SimpleRuntime, BatchedRuntime, FusedRuntime, behavior
+
+SCENARIOS = {}
+
+
+def scenario(**defaults):
+    """Register a scenario with its default parameters."""
+    def register(f):
+        SCENARIOS[f.__name__] = (f, defaults)
+        return f
+    return register
+
+
+def run_loop():
+    """Run the event loop until a behavior calls `stop`."""
+    start = time.perf_counter()
+    EventLoop().run()
+    return time.perf_counter() - start
+
+
+def stop():
+    EventLoop().stop()
+
+
+@scenario(m=100000, n=10)
+def ring(m, n):
+    """Build a ring of `m` actors and send a token `n` times around."""
+    return ring_with(SimpleRuntime(), m, n)
+
+
+@scenario(m=100000, n=10)
+def ring_batched(m, n):
+    """Like `ring`, with mailboxes drained in batches."""
+    return ring_with(BatchedRuntime(), m, n)
+
+
+@scenario(m=100000, n=10)
+def ring_fused(m, n):
+    """Like `ring`, delivering directly to idle actors."""
+    return ring_with(FusedRuntime(), m, n)
+
+
+def ring_with(runtime, m, n):
+    from ..erlang_challenge import ringbuilder_beh
+
+    laps = []
+
+    def lap(left):
+        laps.append(time.perf_counter())
+        if not left:
+            stop()
+
+    first = runtime.create(ringbuilder_beh, m)
+    first << {'first': first, 'n': n, 'lap': lap}
+    start = time.perf_counter()
+    run_loop()
+    construction = laps[0] - start
+    intervals = [t1 - t0 for t0, t1 in zip(laps, laps[1:])]
+    return {'messages': m * n,
+            'seconds': laps[-1] - laps[0],
+            'latencies': intervals,
+            'construction_seconds': construction}
+
+
+@scenario(m=10, n=10000)
+def serial(m, n):
+    """Pass a message through a `serial_beh` pipeline of `m` stages,
+    `n` times in a row."""
+    from ..serial import serial_beh, add_beh
+
+    latencies = []
+    started = [0]
+
+    @behavior
+    def driver_beh(left, self, msg):
+        now = time.perf_counter()
+        latencies.append(now - started[0])
+        if left > 1:
+            self.become(driver_beh, left - 1)
+            started[0] = time.perf_counter()
+            msg['pipeline'] << {'x': 0, 'pipeline': msg['pipeline']}
+        else:
+            stop()
+
+    runtime = SimpleRuntime()
+    driver = runtime.create(driver_beh, n)
+    stages = [runtime.create(add_beh) for i in range(m)]
+    pipeline = runtime.create(serial_beh, stages + [driver])
+    started[0] = time.perf_counter()
+    pipeline << {'x': 0, 'pipeline': pipeline}
+    seconds = run_loop()
+    return {'messages': (2 * m + 2) * n,
+            'seconds': seconds,
+            'latencies': latencies}
+
+
+@scenario(n=100, repeat=200)
+def factorial(n, repeat):
+    """Compute `n`! `repeat` times with continuation actors."""
+    from ..factorial import factorial_beh
+
+    latencies = []
+    started = [0]
+
+    @behavior
+    def customer_beh(fac, left, self, result):
+        now = time.perf_counter()
+        latencies.append(now - started[0])
+        if left > 1:
+            self.become(customer_beh, fac, left - 1)
+            started[0] = time.perf_counter()
+            fac << (self, n)
+        else:
+            stop()
+
+    runtime = SimpleRuntime()
+    fac = runtime.create(factorial_beh)
+    customer = runtime.create(customer_beh, fac, repeat)
+    started[0] = time.perf_counter()
+    fac << (customer, n)
+    seconds = run_loop()
+    return {'messages': (2 * n + 2) * repeat,
+            'seconds': seconds,
+            'latencies': latencies}
+
+
+@scenario(width=1000, rounds=100)
+def fanout(width, rounds):
+    """Send to `width` workers and gather their replies, `rounds` times."""
+    latencies = []
+
+    @behavior
+    def worker_beh(self, collector):
+        collector << self
+
+    @behavior
+    def collector_beh(workers, count, left, started, self, msg):
+        if count + 1 < len(workers):
+            self.become(collector_beh, workers, count + 1, left, started)
+            return
+        now = time.perf_counter()
+        latencies.append(now - started)
+        if left > 1:
+            self.become(collector_beh, workers, 0, left - 1,
+                        time.perf_counter())
+            for worker in workers:
+                worker << self
+        else:
+            stop()
+
+    runtime = SimpleRuntime()
+    workers = [runtime.create(worker_beh) for i in range(width)]
+    collector = runtime.create(collector_beh, workers, 0, rounds,
+                               time.perf_counter())
+    for worker in workers:
+        worker << collector
+    seconds = run_loop()
+    return {'messages': 2 * width * rounds,
+            'seconds': seconds,
+            'latencies': latencies}
+
+
+@scenario(n=200000)
+def flipflop(n):
+    """Send `n` messages to an actor changing behavior on each one."""
+
+    @behavior
+    def flip_beh(self, k):
+        self.become(flop_beh)
+        if k:
+            self << k - 1
+        else:
+            stop()
+
+    @behavior
+    def flop_beh(self, k):
+        self.become(flip_beh)
+        if k:
+            self << k - 1
+        else:
+            stop()
+
+    runtime = SimpleRuntime()
+    runtime.create(flip_beh) << n
+    seconds = run_loop()
+    return {'messages': n + 1,
+            'seconds': seconds,
+            'latencies': []}
+
+
+@scenario(n=20000)
+def membrane(n):
+    """Make `n` round trips to an echo actor through a membrane."""
+    from ..membrane import MembraneFactory
+
+    latencies = []
+    started = [0]
+
+    @behavior
+    def echo_beh(self, msg):
+        msg['customer'] << msg['i']
+
+    @behavior
+    def driver_beh(proxy, self, i):
+        now = time.perf_counter()
+        latencies.append(now - started[0])
+        if i > 1:
+            started[0] = time.perf_counter()
+            proxy << {'customer': self, 'i': i - 1}
+        else:
+            stop()
+
+    runtime = SimpleRuntime()
+    membrane_inst = MembraneFactory()
+    this = runtime.create(membrane_inst.membrane_beh)
+    proxy = membrane_inst._create_proxy(this, runtime.create(echo_beh))
+    driver = runtime.create(driver_beh, proxy)
+    started[0] = time.perf_counter()
+    proxy << {'customer': driver, 'i': n}
+    seconds = run_loop()
+    return {'messages': 4 * n,
+            'seconds': seconds,
+            'latencies': latencies}
+
+
+def inject(n, producers, submit):
+    """Count `n` messages sent by `producers` threads with `submit`.
+
+    `submit(actor, messages)` sends a list of messages from a producer
+    thread to the counting actor, running in a `ThreadedRuntime`.
+
+    """
+    from ..runtime import ThreadedRuntime
+
+    done = threading.Event()
+
+    @behavior
+    def count_beh(left, self, msg):
+        if left > 1:
+            self.become(count_beh, left - 1)
+        else:
+            done.set()
+
+    runtime = ThreadedRuntime()
+    per_producer = n // producers
+    counter = runtime.create(count_beh, per_producer * producers)
+    threads = [threading.Thread(target=submit,
+                                args=(counter, list(range(per_producer))))
+               for i in range(producers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    done.wait()
+    seconds = time.perf_counter() - start
+    runtime.pause()
+    return {'messages': per_producer * producers,
+            'seconds': seconds,
+            'latencies': []}
+
+
+@scenario(n=200000, producers=4)
+def inject_threadsafe(n, producers):
+    """Inject messages with one `call_soon_threadsafe` each."""
+    def submit(actor, messages):
+        evloop = actor._context.loop
+        for msg in messages:
+            evloop.thread_do(evloop.loop.call_soon, actor._deliver, msg)
+    return inject(n, producers, submit)
+
+
+@scenario(n=200000, producers=4)
+def inject_send(n, producers):
+    """Inject messages with ``actor << msg`` through the loop inbox."""
+    def submit(actor, messages):
+        for msg in messages:
+            actor << msg
+    return inject(n, producers, submit)
+
+
+@scenario(n=200000, producers=4, batch=1000)
+def inject_send_many(n, producers, batch):
+    """Inject messages with `send_many`, `batch` at a time."""
+    def submit(actor, messages):
+        for i in range(0, len(messages), batch):
+            actor.send_many(messages[i:i + batch])
+    return inject(n, producers, submit)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+@scenario(n=5000)
+def network(n):
+    """Make `n` round trips from a thread through a loopback proxy."""
+    from ..network import NetworkRuntime
+    from ..tools import ask
+
+    @behavior
+    def echo_beh(self, msg):
+        msg['customer'] << msg['i']
+
+    runtime = NetworkRuntime('tcp://localhost:{}'.format(free_port()))
+    echo = runtime.create(echo_beh)
+    proxy = runtime.create(runtime.proxy_beh, runtime.url,
+                           runtime.uid_for_actor(echo))
+    latencies = []
+    start = time.perf_counter()
+    for i in range(n):
+        t0 = time.perf_counter()
+        ask(proxy, {'i': i}, timeout=10).result()
+        latencies.append(time.perf_counter() - t0)
+    return {'messages': 3 * n,
+            'seconds': time.perf_counter() - start,
+            'latencies': latencies}
@@ -0,0 +1,31 @@
+"""
+
+Default instances
+=================
+
+Metaclass giving a class a default instance.
+
+Use as::
+
+    class MyClass(object, metaclass=DefaultInstance): ...
+
+Calling ``MyClass()`` without arguments returns the default instance of
+the class, created on the first call.  Calling it with arguments always
+creates a new, independent instance.  Each subclass has its own
+default.
+
+"""
+
+class DefaultInstance(type):
+
+    def __init__(self, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        self.default_instance = None
+
+    def __call__(self, *args, **kwargs):
+        if args or kwargs:
+            return super().__call__(*args, **kwargs)
+        instance = self.default_instance
+        if instance is None:
+            instance = self.default_instance = super().__call__()
+        return instance
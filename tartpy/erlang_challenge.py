@@ -17,13 +17,12 @@ def ringlink_beh(next, self, n):
     next << n
 
 @behavior
-def ringlast_beh(first, self, n):
-    loop_completion_times.append(time.time())
+def ringlast_beh(first, lap, self, n):
+    lap(n - 1)
     if n > 1:
         first << n-1
     else:
         self.become(sink_beh)
-        report()
 
 @behavior
 def sink_beh(self, msg):
@@ -31,15 +30,30 @@ def sink_beh(self, msg):
 
 @behavior
 def ringbuilder_beh(m, self, msg):
+    """Build a ring of `m` more actors, then send the token around.
+
+    The message holds the first actor in `first`, the number of laps
+    in `n` and a function `lap`, called with the number of laps left
+    once the ring is built and after each lap.
+
+    """
     if m > 0:
         next = self.create(ringbuilder_beh, m-1)
         next << msg
         self.become(ringlink_beh, next)
     else:
-        global construction_end_time
-        construction_end_time = time.time()
+        msg['lap'](msg['n'])
         msg['first'] << msg['n']
-        self.become(ringlast_beh, msg['first'])
+        self.become(ringlast_beh, msg['first'], msg['lap'])
+
+def lap(left):
+    global construction_end_time
+    if construction_end_time == 0:
+        construction_end_time = time.time()
+    else:
+        loop_completion_times.append(time.time())
+    if not left:
+        report()
 
 def erlang_challenge(m, n):
     print('Starting {} actor ring'. format(m))
@@ -47,7 +61,7 @@ def erlang_challenge(m, n):
     runtime = SimpleRuntime()
     construction_start_time = time.time()
     ring = runtime.create(ringbuilder_beh, m)
-    ring << {'first': ring, 'n': n}
+    ring << {'first': ring, 'n': n, 'lap': lap}
 
 def report():
     print('Construction time: {} seconds'.format(
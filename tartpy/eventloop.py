@@ -3,29 +3,48 @@
 Very basic implementation of an event loop
 ==========================================
 
-The eventloop is a singleton to schedule and run events.
+The eventloop schedules and runs events.  ``EventLoop()`` returns the
+default eventloop, on the default asyncio loop of the process.  Create
+independent eventloops with ``EventLoop(loop)`` or ``EventLoop.new()``,
+for example one per thread.
 
 Exports
 -------
 
 - ``EventLoop``: the basic eventloop
+- ``Inbox``: batched submission of calls from other threads
+- ``Dispatcher``: batched delivery of messages to per-actor mailboxes
+- ``FusedDispatcher``: also delivers directly to idle actors
+- ``TimingWheel``, ``Timer``: delayed events with O(1) insert and cancel
 
 """
 
 import asyncio
+from collections import deque
 import queue
 import sched
 import threading
 import time
 
-from .singleton import Singleton
+from .defaults import DefaultInstance
 
 
-class EventLoop(object, metaclass=Singleton):
+class EventLoop(object, metaclass=DefaultInstance):
 
-    def __init__(self):
-        self.loop = asyncio.get_event_loop()
+    timer_resolution = 0.01  # secs
+
+    def __init__(self, loop=None):
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
         self.do = self.sync_do
+        self.timers = TimingWheel(self, self.timer_resolution)
+        self.inbox = Inbox(self.loop)
+        self.thread = None
+        self.thread_id = None
+
+    @classmethod
+    def new(cls):
+        """Return an eventloop on a new asyncio loop."""
+        return cls(asyncio.new_event_loop())
 
     def sync_do(self, f, *args, **kwargs):
         f(*args, **kwargs)
@@ -33,11 +52,45 @@ class EventLoop(object, metaclass=Singleton):
     def thread_do(self, f, *args, **kwargs):
         self.loop.call_soon_threadsafe(f, *args, **kwargs)
 
-    def schedule(self, target, event):
-        self.do(self.loop.call_soon, event)
+    def inbox_do(self, f, *args):
+        """Call `f(*args)` in the loop thread.
+
+        Called from the loop thread, run it now; from other threads,
+        put it in the inbox, which wakes the loop once per batch.
+
+        """
+        if threading.get_ident() == self.thread_id:
+            f(*args)
+        else:
+            self.inbox.put(f, args)
+
+    def do_many(self, f, args_list):
+        """Call `f(*args)` for each tuple in `args_list`, in order.
+
+        Like `do`, but the whole list is submitted at once, so a loop
+        in another thread is woken a single time.
+
+        """
+        self.do(_call_many, f, args_list)
+
+    def schedule(self, target, event, *args):
+        self.do(self.loop.call_soon, event, *args)
+
+    def later(self, delay, event, *args):
+        """Call `event(*args)` after `delay` seconds.
 
-    def later(self, delay, event):
-        self.do(self.loop.call_later, delay, event)
+        Return a `Timer`, whose `cancel` method prevents the call.
+        Delays shorter than the resolution of the timing wheel are
+        scheduled on the asyncio loop as they are; longer ones are
+        rounded up to the resolution.
+
+        """
+        timer = Timer(self.timers, self.loop.time() + delay, event, args)
+        if delay < self.timers.resolution:
+            self.do(self.loop.call_at, timer.deadline, timer.fire)
+        else:
+            self.do(self.timers.add, timer)
+        return timer
 
     def run(self):
         self.do = self.sync_do
@@ -47,16 +100,413 @@ class EventLoop(object, metaclass=Singleton):
         self.stop_later()
         self.run()
         
-    def run_in_thread(self):
-        self.do = self.thread_do
-        self.thread = threading.Thread(target=self.loop.run_forever,
+    def run_in_thread(self, batched=False):
+        """Run the loop in a new daemon thread.
+
+        With `batched`, calls from other threads go through the inbox
+        (see `inbox_do`) instead of one `call_soon_threadsafe` each.
+
+        """
+        self.do = self.inbox_do if batched else self.thread_do
+        self.thread = threading.Thread(target=self._run_thread,
                                        name='asyncio_event_loop')
         self.thread.daemon = True
         self.thread.start()
 
+    def _run_thread(self):
+        self.thread_id = threading.get_ident()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.thread_id = None
+
     def stop(self):
         self.thread_do(self.loop.stop)
 
     def stop_later(self):
         self.do = self.sync_do
-        self.schedule(self, self.stop)
\ No newline at end of file
+        self.schedule(self, self.stop)
+
+
+def _call_many(f, args_list):
+    for args in args_list:
+        f(*args)
+
+
+class Inbox(object):
+    """Calls submitted to a loop from other threads.
+
+    Producers append to a queue under a lock, and only the producer
+    finding the inbox idle wakes the loop, so a burst of submissions
+    costs a single `call_soon_threadsafe`.  The loop takes the whole
+    batch at once and runs it in order.
+
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.calls = []
+        self.waiting = False
+
+    def __len__(self):
+        return len(self.calls)
+
+    def put(self, f, args):
+        with self.lock:
+            self.calls.append((f, args))
+            if self.waiting:
+                return
+            self.waiting = True
+        self.loop.call_soon_threadsafe(self.drain)
+
+    def drain(self):
+        with self.lock:
+            calls = self.calls
+            self.calls = []
+            self.waiting = False
+        for f, args in calls:
+            try:
+                f(*args)
+            except Exception as exc:
+                # reported as a failed callback, the batch goes on
+                self.loop.call_exception_handler({
+                    'message': 'Exception in inbox call {!r}'.format(f),
+                    'exception': exc})
+
+
+class Dispatcher(object):
+    """Deliver messages through per-actor mailboxes.
+
+    Instead of scheduling one loop callback per message, each actor
+    keeps a deque of pending messages and only actors with pending
+    messages sit in the run queue.  A single loop callback delivers up
+    to `batch_size` messages per tick, one message per actor per turn,
+    so actors are served fairly.
+
+    `when_delivered` tells when the messages sent to an actor so far
+    are delivered.
+
+    """
+
+    def __init__(self, evloop, batch_size=64):
+        self.evloop = evloop
+        self.batch_size = batch_size
+        self.run_queue = deque()
+        self.scheduled = False
+        # actor -> [messages delivered, deque of (count, callback)]:
+        # each callback waits until `count` messages are delivered
+        self.delivery_callbacks = {}
+
+    def enqueue(self, actor, msg):
+        self.evloop.do(self._enqueue, actor, msg)
+
+    def _enqueue(self, actor, msg):
+        mailbox = actor._mailbox
+        if mailbox is None:
+            mailbox = actor._mailbox = deque()
+        mailbox.append(msg)
+        if len(mailbox) == 1:
+            self.run_queue.append(actor)
+            if not self.scheduled:
+                self.scheduled = True
+                self.evloop.schedule(self, self.drain)
+
+    def drain(self):
+        run_queue = self.run_queue
+        try:
+            for _ in range(self.batch_size):
+                if not run_queue:
+                    break
+                actor = run_queue.popleft()
+                mailbox = actor._mailbox
+                try:
+                    actor._deliver(mailbox[0])
+                finally:
+                    # even if `_deliver` raised, the message is gone
+                    mailbox.popleft()
+                    if mailbox:
+                        run_queue.append(actor)
+                    if self.delivery_callbacks:
+                        self.delivered(actor)
+        finally:
+            if run_queue:
+                self.evloop.schedule(self, self.drain)
+            else:
+                self.scheduled = False
+
+    def occupy(self, actor, f, *args):
+        """Call `f(*args)`, delivering messages to `actor`, as a delivery.
+
+        The messages sent to `actor` meanwhile are queued in its
+        mailbox, as during any delivery, and delivered after the call.
+        Must be called from the loop thread, outside of a delivery to
+        `actor`.
+
+        """
+        mailbox = actor._mailbox
+        if mailbox:
+            # already waiting in the run queue
+            f(*args)
+            return
+        if mailbox is None:
+            mailbox = actor._mailbox = deque()
+        # placeholder making the actor look busy
+        mailbox.append(None)
+        try:
+            f(*args)
+        finally:
+            mailbox.popleft()
+            if mailbox:
+                self.run_queue.append(actor)
+                if not self.scheduled:
+                    self.scheduled = True
+                    self.evloop.schedule(self, self.drain)
+            if self.delivery_callbacks:
+                self.delivered(actor)
+
+    def when_delivered(self, actor, callback):
+        """Call `callback()` once the messages now in the mailbox of
+        `actor` are delivered.
+
+        Messages sent to `actor` later do not delay the call.  Must be
+        called from the loop thread.
+
+        """
+        mailbox = actor._mailbox
+        if not mailbox:
+            callback()
+            return
+        waiting = self.delivery_callbacks.get(actor)
+        if waiting is None:
+            waiting = self.delivery_callbacks[actor] = [0, deque()]
+        waiting[1].append((waiting[0] + len(mailbox), callback))
+
+    def delivered(self, actor):
+        """Count a message delivered to `actor`."""
+        waiting = self.delivery_callbacks.get(actor)
+        if waiting is None:
+            return
+        waiting[0] += 1
+        callbacks = waiting[1]
+        while callbacks and callbacks[0][0] <= waiting[0]:
+            callbacks.popleft()[1]()
+        if not callbacks:
+            del self.delivery_callbacks[actor]
+
+
+class FusedDispatcher(Dispatcher):
+    """Dispatcher delivering messages to idle actors right away.
+
+    An actor is idle when its mailbox is empty.  A message for an idle
+    actor is delivered within the call to `enqueue`, unless `max_depth`
+    deliveries are already nested, in which case it is queued.  The
+    message stays in the mailbox while it is delivered, so the messages
+    the actor receives meanwhile are queued behind it.
+
+    """
+
+    def __init__(self, evloop, batch_size=64, max_depth=8):
+        super().__init__(evloop, batch_size)
+        self.max_depth = max_depth
+        self.depth = 0
+
+    def _enqueue(self, actor, msg):
+        mailbox = actor._mailbox
+        if mailbox or self.depth >= self.max_depth:
+            super()._enqueue(actor, msg)
+            return
+        if mailbox is None:
+            mailbox = actor._mailbox = deque()
+        mailbox.append(msg)
+        self.depth += 1
+        try:
+            actor._deliver(msg)
+        finally:
+            self.depth -= 1
+            mailbox.popleft()
+            if mailbox:
+                self.run_queue.append(actor)
+                if not self.scheduled:
+                    self.scheduled = True
+                    self.evloop.schedule(self, self.drain)
+            if self.delivery_callbacks:
+                self.delivered(actor)
+
+
+class Timer(object):
+    """Handle of an event scheduled in a `TimingWheel`."""
+
+    __slots__ = ('wheel', 'deadline', 'callback', 'args', 'slot',
+                 'cancelled')
+
+    def __init__(self, wheel, deadline, callback, args=()):
+        self.wheel = wheel
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.slot = None
+        self.cancelled = False
+
+    def cancel(self):
+        """Prevent the call, if it did not happen yet."""
+        self.cancelled = True
+        self.wheel.evloop.do(self.wheel.remove, self)
+
+    def fire(self):
+        if not self.cancelled:
+            self.callback(*self.args)
+
+
+class TimingWheel(object):
+    """Hierarchical timing wheel.
+
+    Time is divided in ticks of `resolution` seconds.  The first level
+    has one slot per tick for the next ``2**bits`` ticks, and every
+    following level has slots ``2**bits`` times wider.  Timers sit in
+    the slot of their deadline, in the lowest level covering it, and
+    move down a level when the slots below come round (a cascade), so
+    adding and cancelling a timer are O(1).
+
+    The wheel sleeps until the next tick with timers to fire or to
+    cascade, with a single loop callback, and skips the empty ticks in
+    between.  Timers due at the same tick fire in the order they were
+    added.
+
+    """
+
+    def __init__(self, evloop, resolution=0.01, bits=8, levels=4):
+        self.evloop = evloop
+        self.resolution = resolution
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.span = 1 << (bits * levels)
+        self.wheels = [[{} for _ in range(1 << bits)]
+                       for _ in range(levels)]
+        self.origin = 0.0
+        self.tick = 0
+        self.count = 0
+        self.handle = None
+        # tick of the next callback, if `handle`
+        self.wakeup = None
+
+    def __len__(self):
+        return self.count
+
+    def ticks(self, t):
+        return int((t - self.origin) / self.resolution)
+
+    def add(self, timer):
+        if timer.cancelled:
+            return
+        resolution = self.resolution
+        if self.count == 0:
+            # the wheel was idle: restart it at the current time
+            self.tick = int((self.evloop.loop.time() - self.origin) /
+                            resolution)
+        self.count += 1
+        due = int((timer.deadline - self.origin) / resolution) + 1
+        tick = self._insert(timer, due if due > self.tick else self.tick + 1)
+        if self.handle is None:
+            self._schedule(tick)
+        elif tick < self.wakeup:
+            # sleeping past it
+            self.handle.cancel()
+            self._schedule(tick)
+
+    def remove(self, timer):
+        slot = timer.slot
+        if slot is not None:
+            del slot[timer]
+            timer.slot = None
+            self.count -= 1
+
+    def _insert(self, timer, due):
+        place = due
+        delta = due - self.tick
+        if delta >= self.span:
+            # beyond the wheel: park it in the farthest slot, it will
+            # be placed again when that slot cascades
+            place = self.tick + self.span - 1
+            delta = self.span - 1
+        shift = (delta >> 1).bit_length() // self.bits * self.bits
+        slot = self.wheels[shift // self.bits][(place >> shift) & self.mask]
+        slot[timer] = due
+        timer.slot = slot
+        # the tick at which the slot fires or cascades
+        return place >> shift << shift
+
+    def _schedule(self, tick):
+        self.wakeup = tick
+        self.handle = self.evloop.loop.call_at(
+            self.origin + tick * self.resolution, self._run)
+
+    def _run(self):
+        self.handle = None
+        try:
+            self.advance(self.evloop.loop.time())
+        finally:
+            if self.count and self.handle is None:
+                self._schedule(self._next_event())
+
+    def _next_event(self):
+        """Return the next tick with a slot to fire or to cascade."""
+        bits = self.bits
+        mask = self.mask
+        best = None
+        for level, slots in enumerate(self.wheels):
+            shift = bits * level
+            # the slots of this level come round every 2**shift ticks
+            base = self.tick >> shift
+            if best is not None and (base + 1) << shift >= best:
+                break
+            for i in range(1, mask + 2):
+                tick = (base + i) << shift
+                if best is not None and tick >= best:
+                    break
+                if slots[(base + i) & mask]:
+                    best = tick
+                    break
+        return best
+
+    def advance(self, now):
+        """Fire the timers due by time `now`."""
+        target = self.ticks(now)
+        while self.count:
+            tick = self._next_event()
+            if tick > target:
+                break
+            self.tick = tick
+            self._cascade()
+            self._fire(self.wheels[0], tick & self.mask)
+        self.tick = max(self.tick, target)
+
+    def _cascade(self):
+        level = 1
+        while (level < len(self.wheels) and
+               not self.tick & ((1 << (self.bits * level)) - 1)):
+            slots = self.wheels[level]
+            index = (self.tick >> (self.bits * level)) & self.mask
+            timers = slots[index]
+            if timers:
+                slots[index] = {}
+                for timer, due in timers.items():
+                    self._insert(timer, max(due, self.tick))
+            level += 1
+
+    def _fire(self, slots, index):
+        timers = slots[index]
+        if not timers:
+            return
+        slots[index] = {}
+        for timer in timers:
+            timer.slot = None
+            self.count -= 1
+            try:
+                timer.fire()
+            except Exception as exc:
+                # reported as a failed callback, the other timers fire
+                self.evloop.loop.call_exception_handler({
+                    'message': 'Exception in timer callback {!r}'
+                               .format(timer.callback),
+                    'exception': exc})
@@ -2,20 +2,20 @@ import os
 import sys
 sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), '..'))
 
-from tartpy.runtime import Runtime, behavior
+from tartpy.runtime import Runtime, behavior, raw_behavior
 from tartpy.eventloop import EventLoop
 from tartpy.example import print_beh
 
-@behavior
+@raw_behavior
 def factorial_beh(self, msg):
     customer, n = msg
     if n == 0:
         customer << 1
     else:
-        multiply_by_n = self.create(multiplier_beh, customer, n)
+        multiply_by_n = self.customer(multiplier_beh, customer, n)
         self << (multiply_by_n, n-1)
 
-@behavior
+@raw_behavior
 def multiplier_beh(customer, n, self, m):
     customer << m*n
 
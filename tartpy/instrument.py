@@ -0,0 +1,166 @@
+"""
+
+Instrumentation
+===============
+
+Opt-in metrics on what the runtime is doing.
+
+Use as::
+
+    instrumentation = runtime.instrument()
+    ...
+    instrumentation.snapshot()
+
+The snapshot has:
+
+- ``behaviors``: for each behavior, the number of messages delivered,
+  the number of errors, the total execution time and a histogram of
+  the execution times (buckets are powers of two in microseconds),
+- ``queue_depth``: messages sent and not yet delivered,
+- ``backlog``: the actors with most messages waiting, and how many.
+
+Only the actors created after `instrument` is called are measured.
+To get snapshots periodically, create a reporter::
+
+    reporter = runtime.create(reporter_beh, instrumentation, 10, customer)
+    reporter << 'start'
+
+Exports
+-------
+
+- ``Instrumentation``: the collected metrics
+- ``InstrumentedActor``: actor recording metrics
+- ``reporter_beh``: behavior sending periodic snapshots
+
+"""
+
+import threading
+import time
+
+from .runtime import Actor, behavior, exception_message, _hold_beh
+from .tools import later
+
+
+class BehaviorStats(object):
+
+    __slots__ = ('messages', 'errors', 'seconds', 'histogram')
+
+    def __init__(self):
+        self.messages = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.histogram = {}
+
+
+def behavior_name(func):
+    return '{}.{}'.format(getattr(func, '__module__', '?'),
+                          getattr(func, '__qualname__', repr(func)))
+
+
+class Instrumentation(object):
+
+    BACKLOG_TOP = 10
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+        self.behaviors = {}
+        self.backlog = {}
+        self.sent_count = 0
+        self.delivered_count = 0
+        # messages are sent from any thread
+        self.lock = threading.Lock()
+
+    def sent(self, actor, n=1):
+        with self.lock:
+            self.sent_count += n
+            self.backlog[actor] = self.backlog.get(actor, 0) + n
+
+    def delivered(self, actor, beh, seconds, error):
+        with self.lock:
+            self.delivered_count += 1
+            left = self.backlog.get(actor, 1) - 1
+            if left > 0:
+                self.backlog[actor] = left
+            else:
+                self.backlog.pop(actor, None)
+        try:
+            stats = self.behaviors[beh]
+        except KeyError:
+            stats = self.behaviors[beh] = BehaviorStats()
+        stats.messages += 1
+        stats.errors += error
+        stats.seconds += seconds
+        bucket = int(seconds * 1e6).bit_length()
+        stats.histogram[bucket] = stats.histogram.get(bucket, 0) + 1
+
+    def snapshot(self):
+        """Return the current metrics as a dictionary."""
+        behaviors = {}
+        for func, stats in list(self.behaviors.items()):
+            name = behavior_name(func)
+            entry = behaviors.setdefault(
+                name, {'messages': 0, 'errors': 0, 'seconds': 0.0,
+                       'histogram_us': {}})
+            entry['messages'] += stats.messages
+            entry['errors'] += stats.errors
+            entry['seconds'] += stats.seconds
+            for bucket, count in stats.histogram.items():
+                label = '<{}'.format(1 << bucket)
+                entry['histogram_us'][label] = (
+                    entry['histogram_us'].get(label, 0) + count)
+        with self.lock:
+            backlog = sorted(self.backlog.items(), key=lambda item: -item[1])
+            depth = self.sent_count - self.delivered_count
+        return {'behaviors': behaviors,
+                'queue_depth': depth,
+                'backlog': [(repr(actor), count)
+                            for actor, count in backlog[:self.BACKLOG_TOP]]}
+
+
+class InstrumentedActor(Actor):
+
+    __slots__ = ()
+
+    def send(self, msg):
+        self._context.runtime.instrumentation.sent(self)
+        super().send(msg)
+
+    def send_many(self, messages):
+        messages = list(messages)
+        self._context.runtime.instrumentation.sent(self, len(messages))
+        super().send_many(messages)
+
+    def _deliver(self, msg):
+        beh = self._beh
+        if beh is _hold_beh:
+            # held by a coroutine behavior, measured when delivered
+            beh(*self._args, self, msg)
+            return
+        error = False
+        start = time.perf_counter()
+        try:
+            beh(*self._args, self, msg)
+        except Exception:
+            error = True
+            self.throw(exception_message())
+        self._context.runtime.instrumentation.delivered(
+            self, beh, time.perf_counter() - start, error)
+
+
+@behavior
+def reporter_beh(instrumentation, period, customer, self, message):
+    """Send a snapshot to `customer` every `period` seconds.
+
+    Start with any message, and stop with ``'stop'``.
+
+    """
+    if message == 'stop':
+        self.become(stopped_beh)
+        return
+    customer << instrumentation.snapshot()
+    later(self, period, 'tick')
+
+
+@behavior
+def stopped_beh(self, message):
+    pass
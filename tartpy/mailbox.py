@@ -0,0 +1,219 @@
+"""
+
+Bounded mailboxes
+=================
+
+Limit the number of messages waiting for an actor, and decide what
+happens to the messages beyond the limit.
+
+Create a bounded actor with `SimpleRuntime.create_bounded`::
+
+    worker = runtime.create_bounded(1000, 'drop_oldest', worker_beh)
+
+The pending messages of an actor are those sent to it and not yet
+delivered.  When they reach the capacity, a new message is handled
+according to the policy:
+
+- ``'drop_newest'``: the new message is dropped,
+- ``'drop_oldest'``: the oldest pending message is dropped instead,
+- ``'reject'``: `send` raises `MailboxFull`; sent from a behavior, the
+  error reaches the `throw` of the sending actor,
+- ``'block'``: the sending thread waits until there is room.  Only
+  threads other than the one running the loop of the actor, and not
+  running a loop themselves, can wait: the others get `MailboxFull`, as
+  do the waiting threads if the loop of the actor stops.
+
+The pending messages wait in a queue of the actor's own, and the loop
+only holds a single delivery for the actor at a time, so the memory
+used by a mailbox is bounded by its capacity.
+
+Every limit counts the messages dropped, rejected and deferred (that
+made their producer wait); see `MailboxLimit.stats` and `stats`.
+
+Exports
+-------
+
+- ``MailboxFull``: raised when a message is rejected
+- ``MailboxLimit``: capacity, policy and counters of a mailbox
+- ``stats``: counters of the mailbox of a bounded actor
+
+"""
+
+import asyncio
+from collections import deque
+import threading
+
+from .runtime import ActorContext, _hold_beh
+
+
+class MailboxFull(Exception):
+    """The mailbox of the target actor is full."""
+
+
+class MailboxLimit(object):
+
+    POLICIES = ('drop_newest', 'drop_oldest', 'reject', 'block')
+
+    # secs between checks that a blocked sender can still wait
+    poll_interval = 0.1
+
+    __slots__ = ('capacity', 'policy', 'queue', 'scheduled', 'dropped',
+                 'rejected', 'deferred', 'condition')
+
+    def __init__(self, capacity, policy='reject'):
+        if policy not in self.POLICIES:
+            raise ValueError('unknown policy {!r}'.format(policy))
+        if capacity < 1:
+            raise ValueError('capacity must be positive')
+        self.capacity = capacity
+        self.policy = policy
+        # the pending messages
+        self.queue = deque()
+        # whether a delivery is scheduled for them
+        self.scheduled = False
+        self.dropped = 0
+        self.rejected = 0
+        self.deferred = 0
+        self.condition = threading.Condition()
+
+    def put(self, msg, evloop):
+        """Queue `msg` for an actor running on `evloop`.
+
+        Return True if the actor needs a delivery scheduled.
+
+        """
+        with self.condition:
+            queue = self.queue
+            if len(queue) >= self.capacity:
+                policy = self.policy
+                if policy == 'drop_newest':
+                    self.dropped += 1
+                    return False
+                if policy == 'drop_oldest':
+                    queue.popleft()
+                    self.dropped += 1
+                elif policy == 'block' and _can_wait(evloop):
+                    self.deferred += 1
+                    while (len(queue) >= self.capacity and
+                           _can_wait(evloop)):
+                        self.condition.wait(self.poll_interval)
+                if len(queue) >= self.capacity:
+                    self.rejected += 1
+                    raise MailboxFull('mailbox full ({} messages)'
+                                      .format(self.capacity))
+            queue.append(msg)
+            if self.scheduled:
+                return False
+            self.scheduled = True
+            return True
+
+    def take(self):
+        """Remove the oldest pending message.
+
+        Return it, and whether more messages are pending.
+
+        """
+        with self.condition:
+            queue = self.queue
+            msg = queue.popleft()
+            self.condition.notify()
+            self.scheduled = bool(queue)
+            return msg, self.scheduled
+
+    def stats(self):
+        return {'capacity': self.capacity,
+                'policy': self.policy,
+                'pending': len(self.queue),
+                'dropped': self.dropped,
+                'rejected': self.rejected,
+                'deferred': self.deferred}
+
+
+def _can_wait(evloop):
+    """Whether the current thread can wait for the actors of `evloop`."""
+    thread = evloop.thread
+    if (thread is None or not thread.is_alive() or
+            thread is threading.current_thread()):
+        # the loop does not run in a thread, or would wait for itself
+        return False
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return True
+    return False
+
+
+class BoundedContext(ActorContext):
+    """Context of a bounded actor, carrying its `MailboxLimit`."""
+
+    __slots__ = ('limit',)
+
+    def __init__(self, context, limit):
+        super().__init__(context.runtime, context.loop, context.dispatcher)
+        self.limit = limit
+
+
+# message scheduled in the loop for a bounded actor with pending
+# messages: its delivery takes the oldest of them
+_NEXT = object()
+
+# bounded subclass of each actor class
+_bounded_classes = {}
+
+
+def bounded_class(cls):
+    """Return the subclass of the actor class `cls` checking the limit."""
+    try:
+        return _bounded_classes[cls]
+    except KeyError:
+        pass
+    send = cls.send
+    deliver = cls._deliver
+
+    def bounded_send(self, msg):
+        context = self._context
+        if context.limit.put(msg, context.loop):
+            send(self, _NEXT)
+
+    def bounded_send_many(self, messages):
+        rejected = 0
+        for msg in messages:
+            try:
+                self.send(msg)
+            except MailboxFull:
+                rejected += 1
+        if rejected:
+            raise MailboxFull('mailbox full ({} messages), {} rejected'
+                              .format(self._context.limit.capacity,
+                                      rejected))
+
+    def bounded_deliver(self, msg):
+        if self._beh is _hold_beh:
+            # held by a coroutine behavior: take the message when
+            # delivered again
+            deliver(self, msg)
+            return
+        msg, more = self._context.limit.take()
+        if more:
+            send(self, _NEXT)
+        deliver(self, msg)
+
+    bounded = _bounded_classes[cls] = type(
+        cls.__name__, (cls,), {'__slots__': (),
+                               'send': bounded_send,
+                               'send_many': bounded_send_many,
+                               '_deliver': bounded_deliver})
+    return bounded
+
+
+def bound(actor, capacity, policy='reject'):
+    """Limit the mailbox of `actor`, which must have no pending messages."""
+    actor._context = BoundedContext(actor._context,
+                                    MailboxLimit(capacity, policy))
+    actor.__class__ = bounded_class(type(actor))
+    return actor
+
+
+def stats(actor):
+    """Return the counters of the mailbox of the bounded `actor`."""
+    return actor._context.limit.stats()
@@ -5,18 +5,26 @@ Membrane
 
 A membrane transparently creates proxies.
 
+The membrane remembers the pair proxy/actor only while the proxy is
+reachable (the proxy keeps the actor alive).  Pass `max_proxies` to
+also bound the number of pairs remembered: the least recently used
+ones are then forgotten, and a new proxy is created if the actor shows
+up again.
+
 """
 
+import collections
 import json
 import socket
 import socketserver
 import threading
 import uuid
+import weakref
 from collections.abc import Mapping, Sequence
 
 from logbook import Logger
 
-from .runtime import behavior, Actor, exception_message
+from .runtime import behavior, raw_behavior, Actor, exception_message
 from .tools import actor_map
 
 logger = Logger('membrane')
@@ -24,9 +32,16 @@ logger = Logger('membrane')
 
 class MembraneFactory(object):
     
-    def __init__(self):
-        self.proxy_to_actor = {}
-        self.actor_to_proxy = {}
+    def __init__(self, max_proxies=None):
+        self.proxy_to_actor = weakref.WeakKeyDictionary()
+        self.actor_to_proxy = weakref.WeakValueDictionary()
+        self.max_proxies = max_proxies
+        # id(proxy) -> weakref(proxy), in order of use
+        self.lru = collections.OrderedDict()
+        self.created = 0
+        self.reused = 0
+        self.collected = 0
+        self.evicted = 0
         
     @behavior
     def membrane_beh(self, this, message):
@@ -34,15 +49,45 @@ class MembraneFactory(object):
         getattr(self, tag)(this, message)
 
     def _create_proxy(self, this, actor):
-        if actor in self.actor_to_proxy:
-            return self.actor_to_proxy[actor]
+        proxy = self.actor_to_proxy.get(actor)
+        if proxy is not None:
+            self.reused += 1
+            if self.max_proxies is not None:
+                self.lru.move_to_end(id(proxy))
+            return proxy
         proxy = this.create(self.proxy_beh, actor)
+        self.created += 1
         self.proxy_to_actor[proxy] = actor
         self.actor_to_proxy[actor] = proxy
+        weakref.finalize(proxy, self._collected, id(proxy)).atexit = False
+        if self.max_proxies is not None:
+            self.lru[id(proxy)] = weakref.ref(proxy)
+            while len(self.lru) > self.max_proxies:
+                self._evict(self.lru.popitem(last=False)[1]())
         return proxy
 
+    def _evict(self, proxy):
+        if proxy is None:
+            return
+        actor = self.proxy_to_actor.pop(proxy, None)
+        if self.actor_to_proxy.get(actor) is proxy:
+            del self.actor_to_proxy[actor]
+        self.evicted += 1
+
+    def _collected(self, proxy_id):
+        self.lru.pop(proxy_id, None)
+        self.collected += 1
+
     def _is_proxy(self, actor):
         return actor in self.proxy_to_actor
+
+    def stats(self):
+        """Return the size of the proxy tables and their churn."""
+        return {'size': len(self.proxy_to_actor),
+                'created': self.created,
+                'reused': self.reused,
+                'collected': self.collected,
+                'evicted': self.evicted}
         
     def create_proxy(self, this, message):
         """Create proxy for an actor.
@@ -59,7 +104,7 @@ class MembraneFactory(object):
         proxy = self._create_proxy(this, actor)
         message['customer'] << proxy
         
-    @behavior
+    @raw_behavior
     def proxy_beh(self, actor, this, message):
         actor << self.convert(this, message)
 
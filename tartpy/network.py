@@ -1,85 +1,254 @@
+import asyncio
+import collections
 from collections.abc import Mapping, Sequence
-import json
-import socket
-import socketserver
+import functools
+import os
+import stat
+import sys
+import tempfile
 import threading
 from urllib.parse import urlparse
 import uuid
+import weakref
 
 from logbook import Logger
 
-from .runtime import ThreadedRuntime, behavior, Actor
-from .tools import actor_map, dict_map
+from .mailbox import MailboxFull
+from .runtime import ThreadedRuntime, exception_message, raw_behavior
+from .tools import actor_map, type_map
+from .shm import ShmRing
+from . import wire
 
 
 logger = Logger('network')
 
 
+class UnknownUid(LookupError):
+    """A message refers to a local uid that is not exported."""
+
+
 class NetworkRuntime(ThreadedRuntime):
+    """Runtime whose actors can be referenced from other nodes.
 
-    def __init__(self, url):
-        super().__init__()
+    Exported actors are collected with weighted reference counting.
+    Each reference sent to another node carries a weight, and the
+    exporter keeps the total weight it has given away.  A proxy holds
+    the weight of the references it was built from: forwarding the
+    proxy to a third node gives away half of it, without talking to the
+    owner, and dropping the proxy returns what is left to the owner.
+    When all the weight of an export is back, the owner forgets it.
+
+    Actors exported explicitly with `uid_for_actor` are pinned and never
+    forgotten.  Proxies are held through weak references.  Set
+    `max_exports` to bound the number of exported actors that are not
+    pinned: the least recently exported ones are then forgotten, even
+    if still referenced remotely.
+
+    Messages are encoded with JSON.  Between trusted peers, enable the
+    pickle codecs in a subclass::
+
+        class TrustedRuntime(NetworkRuntime):
+            codecs = ('pickle-oob', 'pickle', 'json')
+
+    """
+
+    # codecs accepted on the wire, in order of preference (see `wire`);
+    # unpickling runs arbitrary code, so the pickle codecs are only for
+    # subclasses talking to trusted peers
+    codecs = ('json',)
+
+    # messages a peer may send before the loop handles them
+    credit_window = 1024
+
+    # weight given to a new reference to a local actor
+    EXPORT_WEIGHT = 1 << 16
+
+    max_exports = None
+
+    def __init__(self, url, evloop=None):
+        super().__init__(evloop)
         self.url = url
-        self.uid_to_actor = {}
+        # local actors exported to the network, and the weight given
+        # away for each uid
+        self.uid_to_actor = collections.OrderedDict()
         self.actor_to_uid = {}
-
-        self.server_type = {'tcp': TCPServer}
+        self.export_weights = {}
+        self.pinned = set()
+        # proxies for remote actors, by `(remote_url, uid)`, and the
+        # weight they hold
+        self.proxies = weakref.WeakValueDictionary()
+        self.proxy_to_ref = weakref.WeakKeyDictionary()
+        self.import_weights = {}
+        self.proxy_hits = 0
+        self.proxy_misses = 0
+        self.exports_released = 0
+        self.exports_evicted = 0
+
+        self.server_type = {'tcp': TCPServer,
+                            'unix': UnixServer,
+                            'shm': ShmServer}
         self.server = self.network_server()
         self.server.start()
 
-        self.client_type = {'tcp': TCPClient}
+        self.client_type = {'tcp': TCPClient,
+                            'unix': UnixClient,
+                            'shm': ShmClient}
         self.clients = {}
 
-    def uid_for_actor(self, actor):
-        uid = self.actor_to_uid.setdefault(actor, uuid.uuid4().hex)
-        self.uid_to_actor[uid] = actor
+    def uid_for_actor(self, actor, pin=True):
+        try:
+            uid = self.actor_to_uid[actor]
+        except KeyError:
+            uid = self.actor_to_uid[actor] = uuid.uuid4().hex
+            self.uid_to_actor[uid] = actor
+            if pin:
+                self.pinned.add(uid)
+            if (self.max_exports is not None and
+                    len(self.uid_to_actor) - len(self.pinned) >
+                    self.max_exports):
+                self.evict(uid)
+            return uid
+        if pin:
+            self.pinned.add(uid)
         return uid
 
-    def actor_for_uid(self, remote_url, uid):
-        proxy = self.uid_to_actor.setdefault(uid,
-                                             self.create(self.proxy_beh,
-                                                         remote_url, uid))
-        self.uid_to_actor[uid] = proxy
-        self.actor_to_uid[proxy] = uid
+    def evict(self, keep):
+        # forget the least recently exported uid, if not pinned
+        for uid in self.uid_to_actor:
+            if uid != keep and uid not in self.pinned:
+                self.forget_uid(uid)
+                self.exports_evicted += 1
+                return
+
+    def forget_uid(self, uid):
+        self.pinned.discard(uid)
+        actor = self.uid_to_actor.pop(uid, None)
+        self.actor_to_uid.pop(actor, None)
+        self.export_weights.pop(uid, None)
+
+    def export(self, uid, weight):
+        """Account for `weight` given away in references to `uid`."""
+        left = self.export_weights[uid] = (self.export_weights.get(uid, 0) +
+                                           weight)
+        if not left:
+            self.collect(uid)
+        elif self.max_exports is not None and uid in self.uid_to_actor:
+            self.uid_to_actor.move_to_end(uid)
+
+    def release(self, uid, weight):
+        """Take back `weight` of the references to the local `uid`."""
+        if uid not in self.uid_to_actor:
+            # already forgotten (evicted)
+            return
+        # the weight can be negative for a while, when a reference
+        # arrives before the message exporting it
+        left = self.export_weights.get(uid, 0) - weight
+        if left:
+            self.export_weights[uid] = left
+        else:
+            self.collect(uid)
+
+    def collect(self, uid):
+        # all the references to `uid` came back
+        if uid in self.pinned:
+            self.export_weights.pop(uid, None)
+        else:
+            self.forget_uid(uid)
+            self.exports_released += 1
+
+    def actor_for_uid(self, remote_url, uid, weight=0):
+        """Return the local actor or the proxy for `uid` at `remote_url`.
+
+        `weight` is the weight of the reference being resolved.  Return
+        ``None`` for an unknown local uid.
+
+        """
+        if remote_url == self.url:
+            actor = self.uid_to_actor.get(uid)
+            if weight:
+                self.release(uid, weight)
+            return actor
+        key = (remote_url, uid)
+        proxy = self.proxies.get(key)
+        if proxy is None:
+            self.proxy_misses += 1
+            proxy = self.proxies[key] = self.create_proxy(remote_url, uid)
+            self.proxy_to_ref[proxy] = key
+            finalizer = weakref.finalize(proxy, self.proxy_collected, key)
+            finalizer.atexit = False
+        else:
+            self.proxy_hits += 1
+        if weight:
+            self.import_weights[key] = self.import_weights.get(key, 0) + weight
         return proxy
 
+    def proxy_collected(self, key):
+        weight = self.import_weights.pop(key, 0)
+        if weight:
+            remote_url, uid = key
+            # may run in any thread
+            self.loop.thread_do(self.network_send_control, remote_url,
+                                {'_release': uid, '_weight': weight})
+
+    def receive_control(self, message):
+        self.release(message['_release'], message['_weight'])
+
+    def reference_stats(self):
+        """Return counters for the exported and imported references."""
+        return {'exported': len(self.uid_to_actor),
+                'imported': len(self.proxies),
+                'released': self.exports_released,
+                'evicted': self.exports_evicted,
+                'proxy_hits': self.proxy_hits,
+                'proxy_misses': self.proxy_misses}
+
+    def flow_stats(self):
+        """Return the credits, backlog and dropped messages by peer."""
+        return {url: {'credits': client.credits,
+                      'backlog': len(client.pending),
+                      'dropped': client.dropped}
+                for url, client in self.clients.items()}
+
+    def create_proxy(self, remote_url, uid):
+        # proxies always live in this process, whatever `create` does
+        return self.actor_class(self, self.proxy_beh, remote_url, uid)
+
     def marshall_actor(self, actor):
-        uid = self.uid_for_actor(actor)
-        return {'_url': self.url,
-                '_uid': uid}
+        key = self.proxy_to_ref.get(actor)
+        if key is not None:
+            weight = self.import_weights.get(key, 0)
+            if weight > 1:
+                # hand over half of our weight to the receiver
+                self.import_weights[key] = weight - weight // 2
+                return wire.ActorRef(key[0], key[1], weight // 2)
+            # no weight left to split: export the proxy itself
+        uid = self.uid_for_actor(actor, pin=False)
+        self.export(uid, self.EXPORT_WEIGHT)
+        return wire.ActorRef(self.url, uid, self.EXPORT_WEIGHT)
 
     def marshall(self, message):
         return actor_map(self.marshall_actor, message)
 
-    def unmarshall_actor(self, msg):
-        return self.actor_for_uid(msg['_url'], msg['_uid'])
+    def unmarshall_actor(self, ref):
+        actor = self.actor_for_uid(ref.url, ref.uid, ref.weight)
+        if actor is None:
+            raise UnknownUid(ref.uid)
+        return actor
 
     def unmarshall(self, message):
-        def primitive(x):
-            return (isinstance(x, Mapping) and
-                    set(x.keys()) == {'_uid', '_url'})
-        return dict_map(self.unmarshall_actor, primitive, message)
+        return type_map(self.unmarshall_actor, wire.ActorRef, message)
         
-    @behavior
+    @raw_behavior
     def proxy_beh(self, remote_url, uid, this, message):
         msg = self.marshall(message)
         self.network_send(remote_url, uid, msg)
 
-    def network_send(self, remote_url, uid, msg, retry=2):
-        client = self.network_client(remote_url)
-        try:
-            client.send({'_to': uid,
-                         '_msg': msg})
-            return
-        except OSError as e:
-            if retry == 2:
-                client.connect()
-                self.network_send(remote_url, uid, msg, retry=1)
-            elif retry == 1:
-                del self.clients[remote_url]
-                self.network_send(remote_url, uid, msg, retry=0)
-            else:
-                self.throw('client failed to send to {}'.format(remote_url))
+    def network_send(self, remote_url, uid, msg):
+        self.network_client(remote_url).send({'_to': uid,
+                                              '_msg': msg})
+
+    def network_send_control(self, remote_url, message):
+        self.network_client(remote_url).send_control(message)
 
     def network_client(self, url):
         try:
@@ -113,26 +282,303 @@ class AbstractClient(object):
     def send(self, message):
         pass
 
-        
+    def send_control(self, message):
+        self.send(message)
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    """Protocol negotiating a codec and then exchanging frames.
+
+    The first frame is the handshake (see `wire`), handled by
+    `handshake`.  The following frames are decoded and passed to
+    `receive`, all the frames read in one chunk at once.  Empty frames
+    carry no message: they call `signalled`.
+
+    The socket is read straight into the buffers of a
+    `wire.FrameReader`, and payloads are decoded from views over them.
+    A peer announcing a frame over `wire.FrameReader.max_frame_size`
+    is disconnected.
+
+    """
+
+    def __init__(self):
+        self.reader = wire.FrameReader()
+        self.codec = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        try:
+            return self.reader.get_buffer(sizehint)
+        except wire.FrameTooLarge as exc:
+            self.refuse(exc)
+            return self.reader.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        try:
+            self.frames_received(self.reader.buffer_updated(nbytes))
+        except wire.FrameTooLarge as exc:
+            self.refuse(exc)
+
+    def data_received(self, data):
+        try:
+            self.frames_received(self.reader.feed(data))
+        except wire.FrameTooLarge as exc:
+            self.refuse(exc)
+
+    def refuse(self, exc):
+        """Drop the connection of a peer sending an oversized frame."""
+        logger.error('dropping connection: {}', exc)
+        # discard what was read, until the connection is closed
+        self.reader = wire.FrameReader()
+        self.transport.abort()
+
+    def frames_received(self, payloads):
+        messages = []
+        signals = False
+        for payload in payloads:
+            if self.codec is None:
+                self.handshake(payload)
+                if self.codec is None:
+                    self.transport.close()
+                    return
+            elif not payload:
+                signals = True
+            else:
+                messages.append(self.codec.decode(payload))
+        if messages:
+            self.receive(messages)
+        if signals:
+            self.signalled()
+
+    def frame(self, message):
+        """Return the frame for `message`, as a list of buffers."""
+        return wire.frame_parts(self.codec.encode_parts(message))
+
+    def handshake(self, payload):
+        raise NotImplementedError()
+
+    def receive(self, messages):
+        raise NotImplementedError()
+
+    def signalled(self):
+        """Called for empty frames, used by some transports as signals."""
+        pass
+
+
+class TCPClientProtocol(FrameProtocol):
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        transport.write(wire.offer(self.client.runtime.codecs))
+
+    def handshake(self, payload):
+        name = str(payload, 'ascii')
+        if name in wire.CODECS:
+            self.codec = wire.CODECS[name]
+            self.client.ready(self)
+        else:
+            self.client.failed('no common codec')
+
+    def receive(self, messages):
+        for message in messages:
+            if '_credit' in message:
+                self.client.grant(message['_credit'])
+
+    def connection_lost(self, exc):
+        self.client.failed(exc or 'connection closed')
+
+
 class TCPClient(AbstractClient):
+    """Client sending frames over an asyncio connection.
+
+    Sending never blocks: messages sent before the connection is ready
+    are kept and flushed once the handshake completes.  Must be used
+    from the runtime loop.  A message the codec cannot encode is
+    reported to the runtime and skipped, without affecting the others.
+
+    Frames are coalesced: they are buffered and written together at
+    the end of the current loop tick, or after `flush_delay` seconds if
+    it is positive, or as soon as `flush_bytes` bytes are buffered.
+    With the ``pickle-oob`` codec, large buffers are kept as they are
+    until written, so a sender must not change a `bytearray` or the
+    target of a `memoryview` it sent.
+
+    Sending is limited by credits: each message uses one, and the
+    server grants them as its loop delivers the messages (see
+    `TCPServerProtocol`).  Without credits, messages wait in the
+    backlog, unencoded.  The messages beyond `max_backlog` (if not
+    None) are dropped and counted in `dropped`.
+
+    Control messages (see `send_control`) take no credits and are
+    never dropped, but wait behind the backlog: a release must not
+    overtake the messages to the actor it releases.
+
+    """
+
+    flush_delay = 0 # seconds
+    flush_bytes = 64 * 1024
+
+    max_backlog = 64 * 1024
+
+    protocol_class = TCPClientProtocol
 
     def __init__(self, runtime, url):
         super().__init__(runtime, url)
         parsed = urlparse(url)
         self.host = parsed.hostname
         self.port = parsed.port
+        self.loop = runtime.loop.loop
+        self.protocol = None
+        # messages waiting for the connection or for credits
+        self.pending = collections.deque()
+        self.credits = 0
+        self.dropped = 0
+        self.buffer = []
+        self.buffered = 0
+        # number of parts in `buffer` of each buffered frame
+        self.frames = collections.deque()
+        self.flush_handle = None
         self.connect()
 
     def connect(self):
-        self.socket = socket.socket()
-        self.socket.connect((self.host, self.port))
-        self.socket_file = self.socket.makefile('w', encoding='utf-8')
+        self.loop.create_task(self._connect())
+
+    async def _connect(self):
+        try:
+            await self.open_connection(lambda: self.protocol_class(self))
+        except OSError as exc:
+            self.failed(exc)
+
+    def open_connection(self, factory):
+        return self.loop.create_connection(factory, self.host, self.port)
 
     def send(self, message):
-        self.socket_file.write(json.dumps(message) + '\n')
-        self.socket_file.flush()
-        
-        
+        if self.pending or not self.credits or self.protocol is None:
+            self.hold(message)
+            return
+        self.credits -= 1
+        self.write(message)
+
+    def send_control(self, message):
+        """Send `message` after the backlog, whatever the credits."""
+        if self.pending or self.protocol is None:
+            self.pending.append(message)
+            return
+        self.write(message)
+
+    def hold(self, message):
+        if (self.max_backlog is not None and
+                len(self.pending) >= self.max_backlog):
+            if not self.dropped:
+                self.runtime.throw({'error': 'backlog to {} full, dropping '
+                                    'messages'.format(self.url)})
+            self.dropped += 1
+            return
+        self.pending.append(message)
+
+    def grant(self, credits):
+        """Add `credits` granted by the server, and send the backlog."""
+        self.credits += credits
+        pending = self.pending
+        while pending and self.protocol is not None:
+            if '_to' in pending[0]:
+                if not self.credits:
+                    break
+                self.credits -= 1
+            self.write(pending.popleft())
+
+    def write(self, message):
+        try:
+            parts = self.protocol.frame(message)
+        except Exception:
+            # report it and go on with the other messages
+            error = exception_message()
+            error['error'] = 'cannot encode message to {}'.format(self.url)
+            self.runtime.throw(error)
+            if '_to' in message:
+                self.credits += 1
+            return
+        self.buffer.extend(parts)
+        self.buffered += sum(len(part) for part in parts)
+        self.frames.append(len(parts))
+        if self.buffered >= self.flush_bytes:
+            self.flush()
+        elif self.flush_handle is None:
+            if self.flush_delay > 0:
+                self.flush_handle = self.loop.call_later(self.flush_delay,
+                                                         self.flush)
+            else:
+                self.flush_handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.buffer and self.protocol is not None:
+            write_parts(self.protocol.transport, self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        self.frames.clear()
+
+    def ready(self, protocol):
+        self.protocol = protocol
+        # the server grants the first credits right after the handshake
+        self.grant(0)
+
+    def failed(self, reason):
+        # forget this client, so that the next send reconnects
+        if self.runtime.clients.get(self.url) is self:
+            del self.runtime.clients[self.url]
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        lost = len(self.pending) + len(self.frames)
+        self.pending = collections.deque()
+        self.credits = 0
+        self.buffer = []
+        self.buffered = 0
+        self.frames.clear()
+        if lost:
+            self.runtime.throw({'error': 'client failed to send to {}: {}'
+                                .format(self.url, reason),
+                                'lost': lost})
+
+
+# buffers of at least this size are written without joining them
+LARGE_BUFFER = 64 * 1024
+
+
+def write_parts(transport, parts):
+    """Write the buffers `parts`, copying as little as possible.
+
+    Since Python 3.12, `writelines` sends the buffers with a single
+    scatter-gather ``sendmsg``.  Before, it joins them, so large
+    buffers are written on their own and only small ones are joined.
+
+    """
+    if sys.version_info >= (3, 12):
+        transport.writelines(parts)
+        return
+    small = []
+    for part in parts:
+        if len(part) < LARGE_BUFFER:
+            small.append(part)
+            continue
+        if small:
+            transport.write(b''.join(small))
+            small = []
+        transport.write(part)
+    if small:
+        transport.write(b''.join(small))
+
+
 class AbstractServer(object):
 
     def __init__(self, runtime):
@@ -144,41 +590,352 @@ class AbstractServer(object):
     def receive_message(self, message):
         pass
 
+    def receive_messages(self, messages):
+        for message in messages:
+            self.receive_message(message)
+
+
+class TCPServerProtocol(FrameProtocol):
+    """Server side of a connection, granting credits to the client.
+
+    Right after the handshake the client gets `credit_window` credits
+    of the runtime, one per message sent to an actor (control messages
+    take none).  A message is granted back once delivered: when the
+    loop ran the callbacks scheduled before it, and, for the actors of
+    a batched runtime on this loop, when the messages queued before it
+    in the mailbox of its target are delivered, whatever the target
+    receives afterwards (see `eventloop.Dispatcher.when_delivered`).
+    Credits are granted in batches of a quarter of the window, so a
+    client never has more than a window of messages waiting in the
+    server.
+
+    """
+
+    def __init__(self, server):
+        super().__init__()
+        self.server = server
+        self.window = server.runtime.credit_window
+        self.handled = 0
+
+    def handshake(self, payload):
+        name = wire.choose(payload, self.server.runtime.codecs)
+        self.transport.write(wire.frame((name or '').encode('ascii')))
+        if name is not None:
+            self.codec = wire.CODECS[name]
+            self.grant(self.window)
+
+    def receive(self, messages):
+        sent = self.server.receive_messages(messages)
+        n = sum(1 for message in messages if '_to' in message)
+        if n:
+            self.server.runtime.loop.loop.call_soon(self.delivered, n,
+                                                    sent)
+
+    def delivered(self, n, sent):
+        """Call `consumed` for the `n` messages as they are delivered.
+
+        `sent` lists the targets with the number of messages each got;
+        the other messages were not delivered at all.
+
+        """
+        evloop = self.server.runtime.loop
+        for target, count in sent:
+            if target._mailbox and target._context.loop is evloop:
+                n -= count
+                target._context.dispatcher.when_delivered(
+                    target, functools.partial(self.consumed, count))
+        if n:
+            self.consumed(n)
+
+    def consumed(self, n):
+        self.handled += n
+        if self.handled >= max(1, self.window // 4):
+            self.grant(self.handled)
+            self.handled = 0
+
+    def grant(self, credits):
+        if not self.transport.is_closing():
+            write_parts(self.transport, self.frame({'_credit': credits}))
+
 
 class TCPServer(AbstractServer):
+    """Server accepting connections in the runtime loop."""
 
     def __init__(self, runtime):
         super().__init__(runtime)
         parsed = urlparse(self.runtime.url)
         self.host = parsed.hostname
         self.port = parsed.port
-        
+
+    protocol_class = TCPServerProtocol
+
     def start(self):
-        class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-            allow_reuse_address = True
- 
-        class ThreadedTCPHandler(socketserver.StreamRequestHandler):
-            def handle(this):
-                while True:
-                    s = this.rfile.readline().decode('utf-8')
-                    if not s:
-                        return
-                    wrapped_msg = json.loads(s)
-                    self.receive_message(wrapped_msg)
-
-        server = ThreadedTCPServer((self.host, self.port), ThreadedTCPHandler)
-        server_thread = threading.Thread(target=server.serve_forever,
-                                         name='tcp_server')
-        server_thread.daemon = True
-        server_thread.start()
+        evloop = self.runtime.loop
+        loop = evloop.loop
+        coro = self.create_server(loop, lambda: self.protocol_class(self))
+        if threading.get_ident() == evloop.thread_id:
+            # the loop cannot be waited for from its own thread: listen
+            # as soon as it gets back control
+            self.server = None
+            loop.create_task(self.listen(coro))
+            return
+        # wait until listening, the loop runs in its own thread
+        self.server = asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def listen(self, coro):
+        try:
+            self.server = await coro
+        except OSError as exc:
+            self.runtime.throw({'error': 'cannot listen on {}: {}'
+                                .format(self.runtime.url, exc)})
+
+    def create_server(self, loop, factory):
+        return loop.create_server(factory, self.host, self.port,
+                                  reuse_address=True)
 
     def receive_message(self, message):
-        uid = message['_to']
-        msg = message['_msg']
-        target = self.runtime.actor_for_uid(self.runtime.url, uid)
-        target << self.runtime.unmarshall(msg)
+        self.receive_messages((message,))
+
+    def receive_messages(self, messages):
+        """Deliver `messages`; return the actors they were sent to, with
+        the number of messages sent to each."""
+        runtime = self.runtime
+        url = runtime.url
+        actor_for_uid = runtime.actor_for_uid
+        unmarshall = runtime.unmarshall
+        # the messages for each target, submitted at once
+        batches = {}
+        for message in messages:
+            if '_to' not in message:
+                runtime.receive_control(message)
+                continue
+            target = actor_for_uid(url, message['_to'])
+            if target is None:
+                runtime.throw({'error': "unknown uid '{}'"
+                               .format(message['_to'])})
+                continue
+            try:
+                msg = unmarshall(message['_msg'])
+            except UnknownUid as exc:
+                runtime.throw({'error': "unknown uid '{}' in message to '{}'"
+                               .format(exc.args[0], message['_to'])})
+                continue
+            batch = batches.get(message['_to'])
+            if batch is None:
+                batch = batches[message['_to']] = (target, [])
+            batch[1].append(msg)
+        for uid, (target, batch) in batches.items():
+            try:
+                target.send_many(batch)
+            except MailboxFull as exc:
+                runtime.throw({'error': "messages to '{}' rejected: {}"
+                               .format(uid, exc)})
+        return [(target, len(batch)) for target, batch in batches.values()]
+
+
+class UnixClient(TCPClient):
+    """Client connecting to a ``unix://`` url, as ``unix:///tmp/node``."""
+
+    def __init__(self, runtime, url):
+        self.path = self.socket_path(url)
+        super().__init__(runtime, url)
+
+    def socket_path(self, url):
+        return urlparse(url).path
+
+    def open_connection(self, factory):
+        return self.loop.create_unix_connection(factory, self.path)
+
+
+class UnixServer(TCPServer):
+    """Server listening on the socket file of a ``unix://`` url."""
+
+    def __init__(self, runtime):
+        super().__init__(runtime)
+        self.path = self.socket_path(self.runtime.url)
+
+    def socket_path(self, url):
+        return urlparse(url).path
+
+    def create_server(self, loop, factory):
+        remove_socket(self.path)
+        return loop.create_unix_server(factory, self.path)
+
+
+def remove_socket(path):
+    """Remove the socket file left at `path` by a previous server."""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def shm_socket_path(url):
+    """Path of the control socket of the ``shm://`` url `url`.
+
+    The socket lives in a directory only the current user can access,
+    so that other local users cannot connect to it (see `private_dir`).
+
+    """
+    parsed = urlparse(url)
+    name = (parsed.netloc + parsed.path).replace('/', '_')
+    return os.path.join(private_dir(), 'tartpy-{}.sock'.format(name))
+
+
+def private_dir():
+    """Return a directory only accessible by the current user.
+
+    This is ``$XDG_RUNTIME_DIR`` if set, or else a ``tartpy-<uid>``
+    directory in the temporary directory, created with mode 0700.
+    Raise `PermissionError` if the directory is owned by another user
+    or accessible by others.
+
+    """
+    path = os.environ.get('XDG_RUNTIME_DIR')
+    if not path:
+        path = os.path.join(tempfile.gettempdir(),
+                            'tartpy-{}'.format(os.getuid()))
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass
+    info = os.lstat(path)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+            info.st_mode & 0o077):
+        raise PermissionError('{} is not a private directory'.format(path))
+    return path
+
+
+# empty frame, telling the peer to look at the ring
+SIGNAL = wire.frame(b'')
+
+
+class ShmClientProtocol(TCPClientProtocol):
+
+    def signalled(self):
+        # the server made room in the ring
+        self.client.flush()
+
+
+class ShmClient(UnixClient):
+    """Client writing frames to a shared memory ring.
+
+    It connects to the control socket of the server (see
+    `shm_socket_path`), negotiates the codec as `TCPClient` does and
+    sends the name of a new `shm.ShmRing` of `ring_size` bytes.  Then
+    frames are written to the ring, followed by an empty frame on the
+    socket to wake up the server.  When the ring is full, the client
+    sets the waiting flag of the ring before signalling the server,
+    which answers with an empty frame once it has read the ring.
+
+    """
+
+    ring_size = 4 << 20
+
+    protocol_class = ShmClientProtocol
+
+    def __init__(self, runtime, url):
+        self.ring = None
+        super().__init__(runtime, url)
+
+    def socket_path(self, url):
+        return shm_socket_path(url)
+
+    def ready(self, protocol):
+        self.ring = ShmRing(capacity=self.ring_size)
+        write_parts(protocol.transport,
+                    protocol.frame({'_shm': self.ring.name}))
+        super().ready(protocol)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.protocol is None or self.ring is None:
+            return
+        ring = self.ring
+        buffer = self.buffer
+        written = 0
+        done = 0
+        for part in buffer:
+            n = ring.write(part)
+            written += n
+            if n < len(part):
+                buffer[done] = memoryview(part)[n:]
+                break
+            done += 1
+        del buffer[:done]
+        self.buffered -= written
+        # forget the frames written entirely
+        frames = self.frames
+        while frames and done >= frames[0]:
+            done -= frames.popleft()
+        if done:
+            frames[0] -= done
+        signal = written > 0
+        if buffer and not ring.waiting:
+            # full: the server answers the signal once it made room.
+            # The flag is set before the signal is written, so the
+            # server sees it when handling the signal.
+            ring.waiting = True
+            signal = True
+        if signal:
+            self.protocol.transport.write(SIGNAL)
+
+    def failed(self, reason):
+        super().failed(reason)
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class ShmServerProtocol(TCPServerProtocol):
+
+    def __init__(self, server):
+        super().__init__(server)
+        self.ring = None
+        self.ring_reader = wire.FrameReader()
+
+    def receive(self, messages):
+        if self.ring is None:
+            # the first message names the ring of the client
+            try:
+                self.ring = ShmRing(messages[0]['_shm'])
+            except (OSError, ValueError) as exc:
+                logger.error('dropping connection: {}', exc)
+                self.transport.abort()
+                return
+            messages = messages[1:]
+        if messages:
+            super().receive(messages)
+
+    def signalled(self):
+        ring = self.ring
+        if ring is None:
+            return
+        messages = [self.codec.decode(payload)
+                    for payload in ring.read_into(self.ring_reader)]
+        if messages:
+            super().receive(messages)
+        if ring.waiting:
+            ring.waiting = False
+            self.transport.write(SIGNAL)
+
+    def connection_lost(self, exc):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class ShmServer(UnixServer):
+    """Server for ``shm://`` urls, as ``shm://node``, reading the rings
+    of its clients (see `ShmClient`)."""
 
+    protocol_class = ShmServerProtocol
 
+    def socket_path(self, url):
+        return shm_socket_path(url)
 
 
 def test(port):
@@ -10,6 +10,32 @@ runtime class.
 `SimpleRuntime.create` just creates the actor, and
 `SimpleRuntime.throw` prints the error message to stdout.
 
+``SimpleRuntime()`` returns the default runtime of its class, running
+on the default `EventLoop`.  Pass an eventloop, as in
+``SimpleRuntime(EventLoop.new())``, to create an independent runtime;
+several of them can live in one process, each on its own loop.
+
+`ThreadedRuntime` runs its loop in a background thread; messages sent
+from other threads are queued in the inbox of the loop, which is
+woken once per batch (use `Actor.send_many` to submit many messages at
+once).  `MultiLoopRuntime` runs a pool of loops in as many threads,
+pinning every actor to one of them.
+
+`SimpleRuntime.create_bounded` creates an actor with a limited number
+of pending messages, and a policy for the messages beyond the limit
+(see `mailbox`).
+
+`SimpleRuntime.instrument` turns on the recording of metrics (see
+`instrument`) for the actors created afterwards.  Actors created
+without instrumentation do not pay for it.
+
+By default every message is scheduled as its own event in the loop.
+Set `batched = True` in a runtime class (see `BatchedRuntime`) to
+deliver messages through per-actor mailboxes, drained in batches of
+`batch_size` messages per loop tick.  Set `fused = True` (see
+`FusedRuntime`) to also run the behavior of an idle actor directly
+from `send`, up to `max_depth` nested deliveries.
+
 The behaviors are defined as::
 
     @behavior
@@ -18,11 +44,16 @@ The behaviors are defined as::
 
 where `arg1, ...` are 0 or more arguments to be passed at creation
 time. `self` refers to the actor in context, and `msg` is the message
-being passed.
+being passed.  A mapping message is seen as a `Message`, allowing
+``msg.key`` for ``msg['key']``; declare the behavior with
+`raw_behavior` instead to receive every message untouched.  Declare
+coroutine functions with `async_behavior`, to await asyncio I/O while
+the actor holds its other messages.
 
 To create or change behavior, `self` provides the methods `create` and
-`become`. To send a message to an actor `x` use `x << msg`.  For
-example::
+`become`; `customer` creates a one-shot `Customer`, a cheaper actor
+for continuations receiving a single reply.  To send a message to an
+actor `x` use `x << msg`.  For example::
 
     @behavior
     def my_beh(n, self, msg):
@@ -37,17 +68,21 @@ example::
 
 """
 
+import asyncio
+from collections import deque
 from collections.abc import MutableMapping
-from functools import wraps, partial
+from functools import wraps
+import itertools
+import os
 import pprint
 import sys
 import traceback
 
-from .singleton import Singleton
-from .eventloop import EventLoop
+from .defaults import DefaultInstance
+from .eventloop import EventLoop, Dispatcher, FusedDispatcher
 
 
-class AbstractRuntime(object, metaclass=Singleton):
+class AbstractRuntime(object, metaclass=DefaultInstance):
 
     def create(self, behavior, *args):
         raise NotImplementedError()
@@ -58,12 +93,58 @@ class AbstractRuntime(object, metaclass=Singleton):
 
 class SimpleRuntime(AbstractRuntime):
 
-    def __init__(self):
+    batched = False
+    batch_size = 64
+    fused = False
+    max_depth = 8
+
+    def __init__(self, evloop=None):
         super().__init__()
-        self.loop = EventLoop()
-        
+        self.loop = evloop if evloop is not None else EventLoop()
+        self.dispatcher = self.new_dispatcher(self.loop)
+        self.context = ActorContext(self, self.loop, self.dispatcher)
+        self.actor_class = Actor
+        self.instrumentation = None
+
+    def new_dispatcher(self, evloop):
+        """Return the dispatcher for `evloop`, or None if unbatched."""
+        if self.fused:
+            return FusedDispatcher(evloop, self.batch_size, self.max_depth)
+        if self.batched:
+            return Dispatcher(evloop, self.batch_size)
+        return None
+
     def create(self, behavior, *args):
-        return Actor(self, behavior, *args)
+        return self.actor_class(self, behavior, *args)
+
+    def customer(self, behavior, *args):
+        """Create a one-shot `Customer` (see `Actor.customer`)."""
+        return new_customer(self.context, behavior, args)
+
+    def create_bounded(self, capacity, policy, behavior, *args):
+        """Create an actor with at most `capacity` pending messages.
+
+        `policy` decides what happens to the messages beyond the limit
+        (see `mailbox`).
+
+        """
+        from .mailbox import bound
+        return bound(self.create(behavior, *args), capacity, policy)
+
+    def instrument(self, enabled=True):
+        """Turn on or off metrics for the actors created from now on.
+
+        Return the `instrument.Instrumentation` collecting the metrics.
+
+        """
+        from .instrument import Instrumentation, InstrumentedActor
+        if enabled:
+            if self.instrumentation is None:
+                self.instrumentation = Instrumentation(self)
+            self.actor_class = InstrumentedActor
+        else:
+            self.actor_class = Actor
+        return self.instrumentation
 
     def throw(self, message):
         print('ERROR: {0}'.format(pprint.pformat(message)))
@@ -82,17 +163,106 @@ class Runtime(SimpleRuntime):
 
 class ThreadedRuntime(Runtime):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, evloop=None):
+        super().__init__(evloop)
         self.restart()
 
     def pause(self):
         self.evloop.stop()
 
     def restart(self):
-        self.evloop = EventLoop()
-        self.evloop.run_in_thread()
-        
+        self.evloop = self.loop
+        self.evloop.run_in_thread(batched=True)
+
+
+class MultiLoopRuntime(Runtime):
+    """Runtime running its actors on a pool of loop threads.
+
+    Every actor is pinned at creation to one of `n` eventloops (by
+    default one per CPU), each running in its own thread, and all its
+    messages are delivered there.  Messages sent from other threads go
+    through the inbox of the target loop (see `eventloop.Inbox`), which
+    is woken once per batch.  On free-threaded Python the loops run in
+    parallel; with the GIL, a behavior that blocks only stalls the
+    actors of its own loop.
+
+    `placement` is ``'round_robin'`` to spread new actors over the
+    loops, or ``'local'`` to create the actors on the loop of their
+    creator (round robin when created outside the loops).
+
+    """
+
+    def __init__(self, n=None, placement='round_robin'):
+        if n is None:
+            n = os.cpu_count() or 1
+        self.loops = [EventLoop.new() for _ in range(n)]
+        super().__init__(self.loops[0])
+        self.placement = placement
+        self.contexts = [self.context] + [
+            ActorContext(self, evloop, self.new_dispatcher(evloop))
+            for evloop in self.loops[1:]]
+        self.loop_index = {evloop.loop: i
+                           for i, evloop in enumerate(self.loops)}
+        self.next_loop = itertools.cycle(range(n))
+        self.restart()
+
+    def create(self, behavior, *args):
+        index = None
+        if self.placement == 'local':
+            index = self.current_loop()
+        if index is None:
+            index = next(self.next_loop)
+        return self.create_on(index, behavior, *args)
+
+    def create_on(self, index, behavior, *args):
+        """Create an actor pinned to the loop with index `index`."""
+        actor = self.actor_class(self, behavior, *args)
+        actor._context = self.contexts[index]
+        return actor
+
+    def current_loop(self):
+        """Return the index of the loop running the caller, or None."""
+        try:
+            return self.loop_index.get(asyncio.get_running_loop())
+        except RuntimeError:
+            return None
+
+    def pause(self):
+        for evloop in self.loops:
+            evloop.stop()
+
+    def restart(self):
+        for evloop in self.loops:
+            evloop.run_in_thread(batched=True)
+
+
+class BatchedRuntime(Runtime):
+    """Runtime delivering messages through per-actor mailboxes."""
+
+    batched = True
+
+
+class FusedRuntime(Runtime):
+    """Runtime running the behavior of idle actors directly on send.
+
+    A message sent to an actor with no pending messages is delivered
+    right away, nested in the call to `send`, as long as fewer than
+    `max_depth` deliveries are nested; otherwise it is queued as in
+    `BatchedRuntime`.  Each actor still handles its messages one at a
+    time and in order, but the sender resumes only after the target
+    finished.
+
+    Mapping messages are not copied: the target sees them through a
+    `Message` view of the very dict that was sent.  A target that
+    changes its message thus changes the dict of the sender, and with
+    fused delivery it does so before `send` returns, so a sender
+    reading the dict afterwards, or sending it to another actor, sees
+    the changes.  Targets should treat their messages as read-only.
+
+    """
+
+    fused = True
+
 
 def exception_message():
     """Create a message with details on the exception."""
@@ -103,29 +273,88 @@ def exception_message():
             'traceback': traceback.format_exception(*exc_info)}
     
 
+class ActorContext(object):
+    """State shared by all the actors of a runtime."""
+
+    __slots__ = ('runtime', 'loop', 'dispatcher')
+
+    def __init__(self, runtime, loop, dispatcher):
+        self.runtime = runtime
+        self.loop = loop
+        self.dispatcher = dispatcher
+
+
 class Actor(object):
 
+    __slots__ = ('_context', '_beh', '_args', '_mailbox', '__weakref__')
+
     def __init__(self, runtime, behavior, *args):
-        self._runtime = runtime
-        self.become(behavior, *args)
-        self._loop = self._runtime.loop
+        self._context = runtime.context
+        self._beh = behavior
+        self._args = args
+        self._mailbox = None
+
+    @property
+    def _runtime(self):
+        return self._context.runtime
 
     def become(self, behavior, *args):
-        self._behavior = partial(behavior, *args)
+        if self._beh is _hold_beh:
+            # from a coroutine behavior: takes effect when it finishes
+            held = self._args[0]
+            held.beh = behavior
+            held.args = args
+            return
+        self._beh = behavior
+        self._args = args
 
     def send(self, msg):
-        def event():
-            try:
-                self._behavior(self, msg)
-            except Exception as exc:
-                self.throw(exception_message())
-        self._loop.schedule(self, event)
+        context = self._context
+        if context.dispatcher is not None:
+            context.dispatcher.enqueue(self, msg)
+        else:
+            context.loop.schedule(self, self._deliver, msg)
+
+    def send_many(self, messages):
+        """Send every message of the iterable `messages`, in order.
+
+        From a thread other than the one running the loop, the batch
+        costs a single submission.
+
+        """
+        context = self._context
+        loop = context.loop
+        if context.dispatcher is not None:
+            loop.do_many(context.dispatcher._enqueue,
+                         [(self, msg) for msg in messages])
+        else:
+            loop.do_many(loop.loop.call_soon,
+                         [(self._deliver, msg) for msg in messages])
+
+    def send_later(self, delay, msg):
+        """Send `msg` after `delay` seconds.
+
+        Return a `eventloop.Timer`; call its `cancel` method to drop
+        the message.
+
+        """
+        return self._context.loop.later(delay, self.send, msg)
+
+    def _deliver(self, msg):
+        try:
+            self._beh(*self._args, self, msg)
+        except Exception as exc:
+            self.throw(exception_message())
 
     def create(self, behavior, *args):
-        return self._runtime.create(behavior, *args)
+        return self._context.runtime.create(behavior, *args)
+
+    def customer(self, behavior, *args):
+        """Create a one-shot `Customer` on the loop of this actor."""
+        return new_customer(self._context, behavior, args)
 
     def throw(self, message):
-        self._runtime.throw(message)
+        self._context.runtime.throw(message)
 
     def __lshift__(self, msg):
         """Syntax sugar for sending a message.
@@ -139,10 +368,122 @@ class Actor(object):
         self.send(msg)
 
 
-class Message(dict):
+class Customer(Actor):
+    """Actor accepting a single message.
 
-    __getattr__ = dict.__getitem__
-    __setattr__ = dict.__setitem__
+    A customer is an actor for a continuation: its behavior runs for
+    the first message and later messages are ignored.  It is created
+    without going through `__init__`, and drops its arguments once
+    done.
+
+    Create with `Actor.customer` or `SimpleRuntime.customer`.
+
+    """
+
+    __slots__ = ()
+
+    def _deliver(self, msg):
+        beh = self._beh
+        if beh is None:
+            return
+        if beh is _hold_beh:
+            beh(*self._args, self, msg)
+            return
+        self._beh = None
+        try:
+            beh(*self._args, self, msg)
+        except Exception:
+            self.throw(exception_message())
+        if self._beh is not _hold_beh:
+            # done: release the arguments
+            self._args = ()
+
+
+def new_customer(context, behavior, args):
+    """Return a new `Customer` in `context`."""
+    customer = _new_customer(Customer)
+    customer._context = context
+    customer._beh = behavior
+    customer._args = args
+    customer._mailbox = None
+    return customer
+
+
+_new_customer = Customer.__new__
+
+
+class Message(MutableMapping):
+    """Attribute view of a mapping.
+
+    The mapping is wrapped, not copied: changes through the view are
+    changes to the original mapping.
+
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data=None):
+        if data is None:
+            data = {}
+        elif type(data) is not dict and not isinstance(data, MutableMapping):
+            data = dict(data)
+        _set_data(self, data)
+
+    def __getattr__(self, key):
+        try:
+            return self._data[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key, value):
+        self._data[key] = value
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __eq__(self, other):
+        if type(other) is Message:
+            other = other._data
+        return self._data == other
+
+    def __repr__(self):
+        return 'Message({!r})'.format(self._data)
+
+    def __reduce__(self):
+        return Message, (self._data,)
+
+
+_new_message = Message.__new__
+_set_data = Message._data.__set__
+
+
+def _view(data):
+    message = _new_message(Message)
+    _set_data(message, data)
+    return message
+
+
+# message types never wrapped, checked by exact type
+_PLAIN_TYPES = frozenset((int, float, str, bytes, tuple, list, bool,
+                          type(None), Message))
 
 
 def behavior(f):
@@ -157,12 +498,105 @@ def behavior(f):
     And create or become this behavior by passing the two arguments
     `x` and `y`.
 
+    Mapping messages are passed as a `Message`, so their keys can be
+    read as attributes (``msg.key``).  Other messages are passed
+    unchanged.
+
     """
     @wraps(f)
     def wrapper(*args):
         message = args[-1]
-        if isinstance(message, MutableMapping):
-            message = Message(message)
-        f(*(args[:-1] + (message,)))
+        t = type(message)
+        if t is dict:
+            return f(*args[:-1], _view(message))
+        if t in _PLAIN_TYPES or not isinstance(message, MutableMapping):
+            return f(*args)
+        return f(*args[:-1], _view(message))
+    return wrapper
+
+
+def raw_behavior(f):
+    """Decorator for declaring a function as behavior, without wrapping.
+
+    Like `behavior`, but the message is always passed unchanged (no
+    attribute access for mappings), so delivering a message costs just
+    the call to `f`.  Use it for hot behaviors exchanging tuples,
+    numbers or opaque messages.
+
+    """
+    return f
+
+
+def async_behavior(f):
+    """Decorator for declaring a coroutine function as behavior.
+
+    Use as::
+
+        @async_behavior
+        async def fun(x, self, msg):
+            data = await reader.read()
+            ...
+
+    Messages are passed as with `behavior`.  While the coroutine runs,
+    the actor holds the messages it receives, and delivers them in
+    order when it finishes, so the actor still handles one message at
+    a time.  Calls to `become` from the coroutine take effect when it
+    finishes.
+
+    While the coroutine runs, the behavior of the actor is `_hold_beh`.
+    Held messages are not delivered yet: subclasses overriding
+    `Actor._deliver` to account for deliveries skip them, and account
+    for them when they are delivered after the coroutine.
+
+    """
+    beh = behavior(f)
+
+    @wraps(f)
+    def wrapper(*args):
+        actor = args[-2]
+        task = actor._context.loop.loop.create_task(beh(*args))
+        held = _Held(actor._beh, actor._args)
+        actor._beh = _hold_beh
+        actor._args = (held,)
+        task.add_done_callback(lambda task: _release(actor, held, task))
     return wrapper
 
+
+class _Held(object):
+    """State of an actor running a coroutine behavior: the behavior to
+    restore and the messages held meanwhile."""
+
+    __slots__ = ('beh', 'args', 'pending')
+
+    def __init__(self, beh, args):
+        self.beh = beh
+        self.args = args
+        self.pending = deque()
+
+
+def _hold_beh(held, self, msg):
+    held.pending.append(msg)
+
+
+def _release(actor, held, task):
+    actor._beh = held.beh
+    actor._args = held.args
+    try:
+        task.result()
+    except (Exception, asyncio.CancelledError):
+        actor.throw(exception_message())
+    dispatcher = actor._context.dispatcher
+    if dispatcher is None:
+        _replay(actor, held.pending)
+    else:
+        # the actor is busy until the held messages are delivered
+        dispatcher.occupy(actor, _replay, actor, held.pending)
+
+
+def _replay(actor, pending):
+    while pending:
+        actor._deliver(pending.popleft())
+        if actor._beh is _hold_beh:
+            # held again: keep the rest in front of the new messages
+            actor._args[0].pending.extendleft(reversed(pending))
+            break
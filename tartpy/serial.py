@@ -3,7 +3,7 @@ from .runtime import behavior
 @behavior
 def serial_beh(actors, self, msg):
     if actors:
-        tail = self.create(serial_beh, actors[1:])
+        tail = self.customer(serial_beh, actors[1:])
         msg['reply_to'] = tail
         actors[0] << msg
 
@@ -0,0 +1,299 @@
+"""
+
+Sharded Runtime
+===============
+
+Spread actors across several worker processes, to use more than one
+core.
+
+`ShardedRuntime(url, n)` starts `n` worker processes, each one a
+`NetworkRuntime` listening on the port following `url` (so
+``tcp://localhost:9000`` with ``n = 2`` starts shards on ports 9001
+and 9002).  Every actor created through the runtime is placed on a
+shard, and messages between shards are marshalled exactly as in
+`NetworkRuntime`.  Messages between actors on the same shard never
+leave the process.
+
+Placement is chosen with the `placement` argument:
+
+- ``'round_robin'``: cycle through the shards,
+- ``'hash'``: use a stable hash of the actor uid,
+- ``'local'``: keep the actor in the creating shard (only in workers).
+
+Use `create_on(shard, behavior, *args)` to place an actor explicitly.
+
+Behaviors are sent to the shards by name, so they have to be defined
+at module level, and their arguments have to be marshallable.  A shard
+only creates actors with the behaviors registered with `spawnable`:
+any peer reaching its port can ask for one.  The workers import the
+modules of the behaviors registered in the parent when they start.
+For example::
+
+    @spawnable
+    @behavior
+    def factorial_beh(self, message):
+        ...
+
+    runtime = ShardedRuntime('tcp://localhost:9000', 4)
+    fac = runtime.create(factorial_beh)
+    fac << (customer, 20)
+
+"""
+
+import importlib
+import itertools
+import multiprocessing
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+import uuid
+import zlib
+
+from .network import NetworkRuntime
+from .runtime import behavior, raw_behavior
+
+
+def spawner_uid(url):
+    return 'spawner:{}'.format(url)
+
+
+def shard_urls(url, n):
+    parsed = urlparse(url)
+    return ['{}://{}:{}'.format(parsed.scheme, parsed.hostname,
+                                parsed.port + i)
+            for i in range(1, n + 1)]
+
+
+def behavior_name(beh):
+    module = beh.__module__
+    if module == '__mp_main__':
+        # the main module, as imported by a worker
+        module = '__main__'
+    return '{}:{}'.format(module, beh.__qualname__)
+
+
+# behaviors the shards create actors with, by name
+SPAWNABLE = {}
+
+
+def spawnable(beh):
+    """Decorator registering `beh` as a behavior the shards may spawn."""
+    SPAWNABLE[behavior_name(beh)] = beh
+    return beh
+
+
+def behavior_from_name(name):
+    """Return the spawnable behavior `name`, or raise `KeyError`."""
+    return SPAWNABLE[name]
+
+
+def spawnable_modules():
+    """Return the modules defining the spawnable behaviors."""
+    return sorted({name.split(':')[0] for name in SPAWNABLE} - {'__main__'})
+
+
+class ShardRuntime(NetworkRuntime):
+    """Runtime for one shard.
+
+    It places the actors it creates on its peers according to the
+    `placement` policy, and spawns actors on request of the other
+    shards.
+
+    """
+
+    def __init__(self, url, shards, placement='round_robin', evloop=None):
+        super().__init__(url, evloop)
+        self.shards = tuple(shards)
+        self.placement = placement
+        self.next_shard = itertools.cycle(range(len(self.shards)))
+        # messages for local uids whose spawn request is still in flight
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.create_local(self.spawner_beh, uid=spawner_uid(self.url))
+        self.pinned.add(spawner_uid(self.url))
+
+    def create(self, behavior, *args):
+        uid = uuid.uuid4().hex
+        return self.create_on(self.choose_shard(uid), behavior, *args,
+                              uid=uid)
+
+    def create_on(self, shard, behavior, *args, uid=None):
+        """Create an actor in the shard with index `shard`."""
+        url = self.shards[shard]
+        if url == self.url:
+            # exported with a uid only when sent to another node
+            return self.create_local(behavior, *args)
+        name = behavior_name(behavior)
+        if name not in SPAWNABLE:
+            raise ValueError('behavior {} is not spawnable'.format(name))
+        if uid is None:
+            uid = uuid.uuid4().hex
+        spawner = self.actor_for_uid(url, spawner_uid(url))
+        spawner << {'behavior': name,
+                    'args': list(args),
+                    'uid': uid,
+                    'weight': self.EXPORT_WEIGHT}
+        # we hold the initial reference to the new actor
+        return self.actor_for_uid(url, uid, self.EXPORT_WEIGHT)
+
+    def create_local(self, behavior, *args, uid=None):
+        """Create an actor in this process."""
+        with self.pending_lock:
+            buffer = self.pending.pop(uid, None)
+            if buffer is None:
+                actor = self.actor_class(self, behavior, *args)
+            else:
+                actor = self.uid_to_actor[uid]
+                actor.become(behavior, *args)
+            if uid is not None:
+                self.uid_to_actor[uid] = actor
+                self.actor_to_uid[actor] = uid
+        # the messages held by the placeholder were sent before those
+        # still queued for it: deliver them first
+        for message in buffer or ():
+            actor._deliver(message)
+        return actor
+
+    def actor_for_uid(self, remote_url, uid, weight=0):
+        if remote_url != self.url or uid in self.uid_to_actor:
+            return super().actor_for_uid(remote_url, uid, weight)
+        # A message reached us before the request to spawn its
+        # target: hold it in a placeholder until the spawn arrives.
+        with self.pending_lock:
+            if uid not in self.uid_to_actor:
+                buffer = self.pending[uid] = []
+                actor = self.actor_class(self, pending_beh, buffer)
+                self.uid_to_actor[uid] = actor
+                self.actor_to_uid[actor] = uid
+        return super().actor_for_uid(remote_url, uid, weight)
+
+    def release(self, uid, weight):
+        if uid not in self.uid_to_actor:
+            # The reference came back before the request to spawn its
+            # actor: keep the weight with a placeholder, the export of
+            # the spawn settles it.
+            self.actor_for_uid(self.url, uid)
+        super().release(uid, weight)
+
+    def choose_shard(self, uid):
+        if self.placement == 'round_robin':
+            return next(self.next_shard)
+        if self.placement == 'hash':
+            return zlib.crc32(uid.encode('utf-8')) % len(self.shards)
+        if self.placement == 'local' and self.url in self.shards:
+            return self.shards.index(self.url)
+        self.throw({'error': "unknown placement '{}'"
+                    .format(self.placement)})
+        return next(self.next_shard)
+
+    @behavior
+    def spawner_beh(self, this, message):
+        try:
+            beh = behavior_from_name(message['behavior'])
+        except KeyError:
+            self.throw({'error': "behavior '{}' is not spawnable"
+                        .format(message['behavior'])})
+            return
+        self.create_local(beh, *message['args'], uid=message['uid'])
+        self.export(message['uid'], message['weight'])
+
+
+@raw_behavior
+def pending_beh(buffer, self, message):
+    buffer.append(message)
+
+
+class ShardedRuntime(ShardRuntime):
+    """Runtime owning `n` worker processes.
+
+    The parent process only routes: every actor it creates lives in one
+    of the workers.
+
+    """
+
+    START_TIMEOUT = 10 # seconds
+
+    def __init__(self, url, n, placement='round_robin', evloop=None):
+        super().__init__(url, shard_urls(url, n), placement, evloop)
+        context = multiprocessing.get_context('spawn')
+        self.workers = [
+            context.Process(target=shard_main,
+                            args=(shard, self.shards, placement,
+                                  spawnable_modules()),
+                            name='tartpy_shard_{}'.format(i),
+                            daemon=True)
+            for i, shard in enumerate(self.shards)]
+        for worker in self.workers:
+            worker.start()
+        for shard in self.shards:
+            wait_for_server(shard, self.START_TIMEOUT)
+
+    def choose_shard(self, uid):
+        if self.placement == 'local':
+            return next(self.next_shard)
+        return super().choose_shard(uid)
+
+    def shutdown(self):
+        """Stop the workers and the loop of this runtime."""
+        self.pause()
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+
+
+def wait_for_server(url, timeout):
+    parsed = urlparse(url)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((parsed.hostname, parsed.port)).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def shard_main(url, shards, placement, modules=()):
+    # register the spawnable behaviors of the parent
+    for module in modules:
+        importlib.import_module(module)
+    runtime = ShardRuntime(url, shards, placement)
+    runtime.evloop.thread.join()
+
+
+@spawnable
+@raw_behavior
+def _fib_beh(self, message):
+    customer, n = message
+    if n < 2:
+        customer << n
+    else:
+        adder = self.create(_adder_beh, customer, None)
+        self.create(_fib_beh) << (adder, n - 1)
+        self.create(_fib_beh) << (adder, n - 2)
+
+
+@spawnable
+@raw_behavior
+def _adder_beh(customer, first, self, m):
+    if first is None:
+        self.become(_adder_beh, customer, m)
+    else:
+        customer << first + m
+
+
+def test(port, n, k=15):
+    from .tools import Wait
+
+    runtime = ShardedRuntime('tcp://localhost:{}'.format(port), n)
+    w = Wait()
+    wait = runtime.create_local(w.wait_beh)
+    start = time.time()
+    runtime.create(_fib_beh) << (wait, k)
+    result = w.join()
+    print('fib({}) = {} in {} seconds'.format(k, result, time.time() - start))
+    runtime.shutdown()
+    return result
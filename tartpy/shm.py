@@ -0,0 +1,163 @@
+"""
+
+Shared memory rings
+===================
+
+Single producer, single consumer byte ring in a
+`multiprocessing.shared_memory` segment, used by the ``shm://``
+transport of `network`.
+
+The segment starts with a header holding the total number of bytes
+written (``head``), the total number of bytes read (``tail``), a flag
+set by the writer when it waits for room, and the capacity of the
+ring.  Only the writer moves ``head`` and only the reader moves
+``tail``.
+
+The ring carries no notifications: the transport tells the reader
+that there is data, and the writer that there is room, through a
+socket.  A flag set before writing to the socket is seen by the peer
+once it read from it.
+
+The reader may read ``head`` while the writer goes on writing, and
+nothing fences the accesses to the segment: the reader relies on
+seeing the data before the ``head`` written after it, and the writer
+on the reader being done with the data before it moves ``tail``.  x86
+CPUs keep the stores, and the loads before stores, in order, but
+weakly ordered ones (ARM, POWER...) do not, so rings can only be
+created on x86 (see `SUPPORTED`).
+
+A ring attached by name must belong to the current user.
+
+Exports
+-------
+
+- ``ShmRing``: the ring
+- ``SUPPORTED``: whether rings work on this CPU
+
+"""
+
+from multiprocessing import resource_tracker, shared_memory
+import os
+import platform
+import struct
+import sys
+
+
+COUNTER = struct.Struct('=Q')
+FLAG = struct.Struct('=B')
+
+HEAD = 0
+TAIL = 8
+WAITING = 16
+CAPACITY = 24
+DATA = 32
+
+SUPPORTED = platform.machine().lower() in ('x86_64', 'amd64', 'i386', 'i686',
+                                           'x86')
+
+
+class ShmRing(object):
+    """Ring of `capacity` bytes.
+
+    Create with no `name` to allocate a new segment, owned by this
+    object and unlinked by `close`; with `name`, attach to an existing
+    segment.  Raise `PermissionError` if that segment belongs to
+    another user, and `ValueError` if it is not a valid ring.
+
+    """
+
+    def __init__(self, name=None, capacity=1 << 20):
+        if not SUPPORTED:
+            raise RuntimeError('shared memory rings need a x86 CPU, not {}'
+                               .format(platform.machine()))
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True,
+                                                  size=DATA + capacity)
+            self.owner = True
+            self.buf = self.shm.buf
+            COUNTER.pack_into(self.buf, HEAD, 0)
+            COUNTER.pack_into(self.buf, TAIL, 0)
+            FLAG.pack_into(self.buf, WAITING, 0)
+            COUNTER.pack_into(self.buf, CAPACITY, capacity)
+        else:
+            if sys.version_info >= (3, 13):
+                self.shm = shared_memory.SharedMemory(name, track=False)
+            else:
+                self.shm = shared_memory.SharedMemory(name)
+                # the owner unlinks it, not the tracker of this process
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            self.owner = False
+            self.buf = self.shm.buf
+            try:
+                self.check()
+            except (OSError, ValueError):
+                self.close()
+                raise
+        self.name = self.shm.name
+        self.capacity, = COUNTER.unpack_from(self.buf, CAPACITY)
+
+    def check(self):
+        """Check the owner and the header of an attached segment."""
+        if os.fstat(self.shm._fd).st_uid != os.getuid():
+            raise PermissionError('segment {} belongs to another user'
+                                  .format(self.shm.name))
+        size = self.shm.size
+        if (size < DATA or
+                COUNTER.unpack_from(self.buf, CAPACITY)[0] > size - DATA):
+            raise ValueError('segment {} is not a ring'.format(self.shm.name))
+
+    @property
+    def waiting(self):
+        return bool(FLAG.unpack_from(self.buf, WAITING)[0])
+
+    @waiting.setter
+    def waiting(self, value):
+        FLAG.pack_into(self.buf, WAITING, int(value))
+
+    def __len__(self):
+        """Number of bytes waiting to be read."""
+        buf = self.buf
+        return (COUNTER.unpack_from(buf, HEAD)[0] -
+                COUNTER.unpack_from(buf, TAIL)[0])
+
+    def write(self, data):
+        """Write as much of `data` as fits; return the bytes written."""
+        buf = self.buf
+        capacity = self.capacity
+        head, = COUNTER.unpack_from(buf, HEAD)
+        tail, = COUNTER.unpack_from(buf, TAIL)
+        n = min(capacity - (head - tail), len(data))
+        if not n:
+            return 0
+        data = memoryview(data)
+        pos = head % capacity
+        first = min(n, capacity - pos)
+        buf[DATA + pos:DATA + pos + first] = data[:first]
+        if n > first:
+            buf[DATA:DATA + n - first] = data[first:n]
+        COUNTER.pack_into(buf, HEAD, head + n)
+        return n
+
+    def read_into(self, reader):
+        """Move the bytes written so far into the `wire.FrameReader`
+        `reader`; return the completed payloads."""
+        buf = self.buf
+        capacity = self.capacity
+        head, = COUNTER.unpack_from(buf, HEAD)
+        tail, = COUNTER.unpack_from(buf, TAIL)
+        frames = []
+        while tail < head:
+            target = reader.get_buffer()
+            pos = tail % capacity
+            n = min(len(target), head - tail, capacity - pos)
+            target[:n] = buf[DATA + pos:DATA + pos + n]
+            tail += n
+            COUNTER.pack_into(buf, TAIL, tail)
+            frames.extend(reader.buffer_updated(n))
+        return frames
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -1,10 +1,21 @@
+import asyncio
+from collections import deque
+import concurrent.futures
+import gc
 import threading
+import time
+import weakref
 
 import pytest
 
-from tartpy.runtime import behavior, SimpleRuntime
-from tartpy.eventloop import EventLoop
-from tartpy.tools import Wait
+from tartpy.runtime import (Actor, behavior, raw_behavior, async_behavior,
+                            Message, SimpleRuntime,
+                            BatchedRuntime, MultiLoopRuntime,
+                            ThreadedRuntime, FusedRuntime)
+from tartpy.mailbox import MailboxFull, stats
+from tartpy.eventloop import EventLoop, TimingWheel, Timer, Inbox
+from tartpy.tools import (Wait, ask, ask_async, later, send_many, offload_beh,
+                          actor_map, dict_map)
 
 runtime = SimpleRuntime()
 
@@ -226,3 +237,856 @@ def test_integer_message_attribute():
     actor << 2
     EventLoop().run_once()
     assert isinstance(result, int) and result == 2
+
+
+def test_attribute_view_does_not_copy():
+    result = None
+    @behavior
+    def beh(self, message):
+        nonlocal result
+        message.seen = True
+        result = message
+
+    data = {'foo': 4}
+    actor = runtime.create(beh)
+    actor << data
+    EventLoop().run_once()
+    assert isinstance(result, Message)
+    assert result.foo == 4 and result == {'foo': 4, 'seen': True}
+    assert data['seen']
+    with pytest.raises(AttributeError):
+        result.bar
+
+
+def test_raw_behavior():
+    result = []
+    @raw_behavior
+    def beh(self, message):
+        result.append(message)
+
+    data = {'foo': 4}
+    actor = runtime.create(beh)
+    actor << data
+    actor << (1, 2)
+    EventLoop().run_once()
+    EventLoop().run_once()
+    assert result[0] is data and result[1] == (1, 2)
+
+
+def test_default_instances():
+    assert EventLoop() is EventLoop()
+    assert SimpleRuntime() is runtime
+    assert BatchedRuntime() is not runtime
+    assert SimpleRuntime(EventLoop()) is not runtime
+
+
+def test_independent_loops():
+    results = {}
+    @behavior
+    def beh(name, self, message):
+        results[name] = threading.get_ident()
+
+    loops = [EventLoop.new() for _ in range(2)]
+    assert loops[0].loop is not loops[1].loop
+    runtimes = [SimpleRuntime(evloop) for evloop in loops]
+    for i, rt in enumerate(runtimes):
+        rt.create(beh, i) << 'go'
+        assert rt.loop is loops[i]
+
+    threads = [threading.Thread(target=evloop.run_once)
+               for evloop in loops]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert sorted(results) == [0, 1]
+    assert results[0] != results[1]
+    for evloop in loops:
+        evloop.loop.close()
+
+
+def test_multi_loop_affinity():
+    pool = MultiLoopRuntime(2)
+    try:
+        @behavior
+        def where_beh(self, message):
+            message.customer << (threading.get_ident(), message.n)
+
+        a = pool.create_on(0, where_beh)
+        b = pool.create_on(1, where_beh)
+        futures = [ask(actor, {'n': 0}, timeout=5) for actor in (a, b)]
+        threads = [f.result(5)[0] for f in futures]
+        assert threads == [evloop.thread.ident for evloop in pool.loops]
+    finally:
+        pool.pause()
+
+
+def test_multi_loop_order_and_isolation():
+    pool = MultiLoopRuntime(2)
+    gate = threading.Event()
+    try:
+        received = []
+        done = threading.Event()
+
+        @behavior
+        def record_beh(self, message):
+            received.append(message)
+            if message == 999:
+                done.set()
+
+        @raw_behavior
+        def block_beh(self, gate):
+            gate.wait(5)
+
+        slow = pool.create_on(0, block_beh)
+        record = pool.create_on(1, record_beh)
+        slow << gate
+        for i in range(1000):
+            record << i
+        # done while the other loop is still blocked
+        assert done.wait(5)
+        assert not gate.is_set()
+        assert received == list(range(1000))
+    finally:
+        gate.set()
+        pool.pause()
+
+
+def test_send_many():
+    result = []
+    @behavior
+    def beh(self, message):
+        result.append(message)
+
+    for rt in (runtime, BatchedRuntime()):
+        del result[:]
+        send_many(rt.create(beh), iter(range(10)))
+        EventLoop().run_once()
+        assert result == list(range(10))
+
+
+def test_inbox_single_wakeup():
+    evloop = EventLoop.new()
+    inbox = Inbox(evloop.loop)
+    wakeups = []
+    evloop.loop.call_soon_threadsafe = lambda f: wakeups.append(f)
+    result = []
+    for i in range(5):
+        inbox.put(result.append, (i,))
+    assert len(wakeups) == 1 and len(inbox) == 5
+    wakeups.pop()()
+    assert result == list(range(5)) and len(inbox) == 0
+    inbox.put(result.append, (5,))
+    assert len(wakeups) == 1
+    evloop.loop.close()
+
+
+def test_inbox_error():
+    evloop = EventLoop.new()
+    inbox = Inbox(evloop.loop)
+    errors = []
+    evloop.loop.call_soon_threadsafe = lambda f: None
+    evloop.loop.set_exception_handler(
+        lambda loop, context: errors.append(context['exception']))
+    result = []
+    inbox.put(result.append, (0,))
+    inbox.put(lambda: 1/0, ())
+    inbox.put(result.append, (1,))
+    inbox.drain()
+    assert result == [0, 1]
+    assert [type(error) for error in errors] == [ZeroDivisionError]
+    evloop.loop.close()
+
+
+def test_threaded_send_from_threads():
+    threaded = ThreadedRuntime(EventLoop.new())
+    try:
+        received = []
+        done = threading.Event()
+
+        @behavior
+        def beh(self, message):
+            received.append(message)
+            if len(received) == 400:
+                done.set()
+
+        actor = threaded.create(beh)
+
+        def produce(k):
+            for i in range(100):
+                actor << (k, i)
+            send_many(actor, [(k, i) for i in range(100, 200)])
+
+        producers = [threading.Thread(target=produce, args=(k,))
+                     for k in range(2)]
+        for producer in producers:
+            producer.start()
+        assert done.wait(5)
+        for k in range(2):
+            assert [i for j, i in received if j == k] == list(range(200))
+    finally:
+        threaded.pause()
+
+
+def test_batched_order():
+    result = []
+    @behavior
+    def beh(self, message):
+        result.append(message)
+
+    batched = BatchedRuntime()
+    actor = batched.create(beh)
+    for i in range(50):
+        actor << i
+    EventLoop().run_once()
+    assert result == list(range(50))
+
+
+def test_batched_fairness():
+    result = []
+    @behavior
+    def beh(name, self, message):
+        result.append((name, message))
+        if message > 0:
+            self << message - 1
+
+    batched = BatchedRuntime()
+    a = batched.create(beh, 'a')
+    b = batched.create(beh, 'b')
+    a << 1
+    b << 1
+    EventLoop().run_once()
+    assert result == [('a', 1), ('b', 1), ('a', 0), ('b', 0)]
+
+
+@pytest.mark.parametrize('runtime_class', [BatchedRuntime, FusedRuntime])
+def test_dispatcher_deliver_raises(runtime_class):
+    result = []
+
+    class FailingActor(Actor):
+        __slots__ = ()
+
+        def _deliver(self, msg):
+            if msg == 'boom':
+                raise RuntimeError(msg)
+            super()._deliver(msg)
+
+    @behavior
+    def beh(self, message):
+        result.append(message)
+
+    class TestRuntime(runtime_class):
+        pass
+
+    test_rt = TestRuntime()
+    test_rt.actor_class = FailingActor
+    actor = test_rt.create(beh)
+    other = test_rt.create(beh)
+    loop = EventLoop().loop
+    handler = loop.get_exception_handler()
+    loop.set_exception_handler(lambda loop, context: None)
+    try:
+        for msg in ['boom', 1, 2]:
+            try:
+                actor << msg
+            except RuntimeError:
+                pass
+        EventLoop().run_once()
+        other << 3
+        EventLoop().run_once()
+    finally:
+        loop.set_exception_handler(handler)
+    assert result == [1, 2, 3]
+
+
+def test_batched_when_delivered():
+    result = []
+    @behavior
+    def beh(self, message):
+        result.append(message)
+
+    batched = BatchedRuntime()
+    dispatcher = batched.dispatcher
+    actor = batched.create(beh)
+    dispatcher.when_delivered(actor, lambda: result.append('idle'))
+    for i in range(3):
+        actor << i
+    dispatcher.when_delivered(actor, lambda: result.append('done'))
+    # later messages do not delay the callback
+    for i in range(3, 5):
+        actor << i
+    dispatcher.when_delivered(actor, lambda: result.append('all'))
+    EventLoop().run_once()
+    assert result == ['idle', 0, 1, 2, 'done', 3, 4, 'all']
+    assert not dispatcher.delivery_callbacks
+
+
+def test_batched_error():
+    err = False
+
+    class TestRuntime(BatchedRuntime):
+
+        def throw(self, message):
+            nonlocal err
+            err = True
+
+    @behavior
+    def beh(self, msg):
+        1/0
+
+    x = TestRuntime().create(beh)
+    x << 5
+    EventLoop().run_once()
+    assert err is True
+
+
+@behavior
+def double_beh(self, message):
+    message['customer'] << message['x'] * 2
+
+
+def test_ask():
+    actor = runtime.create(double_beh)
+    future = ask(actor, {'x': 21})
+    EventLoop().run_once()
+    assert future.result(0) == 42
+
+
+def test_ask_function_message():
+    @behavior
+    def beh(self, message):
+        customer, x = message
+        customer << x + 1
+
+    actor = runtime.create(beh)
+    future = ask(actor, lambda customer: (customer, 1))
+    EventLoop().run_once()
+    assert future.result(0) == 2
+
+
+def test_ask_timeout():
+    @behavior
+    def null_beh(self, message):
+        pass
+
+    actor = runtime.create(null_beh)
+    future = ask(actor, {}, timeout=0)
+    EventLoop().loop.run_until_complete(asyncio.sleep(0.05))
+    assert future.done()
+    with pytest.raises(concurrent.futures.TimeoutError):
+        future.result(0)
+
+
+def test_later_cancel():
+    result = []
+    @behavior
+    def beh(self, message):
+        result.append(message)
+
+    actor = runtime.create(beh)
+    kept = later(actor, 0.01, 'kept')
+    dropped = later(actor, 0.01, 'dropped')
+    dropped.cancel()
+    EventLoop().loop.run_until_complete(asyncio.sleep(0.05))
+    assert result == ['kept']
+    assert len(EventLoop().timers) == 0
+
+
+def test_timing_wheel_cascade():
+    wheel = TimingWheel(EventLoop(), resolution=1, bits=2, levels=2)
+    fired = []
+    start = EventLoop().loop.time()
+    for delay in (0, 3, 5, 17, 40):
+        wheel.add(Timer(wheel, start + delay, fired.append, (delay,)))
+    for t in range(50):
+        wheel.advance(start + t)
+        assert all(delay <= t for delay in fired)
+    assert fired == [0, 3, 5, 17, 40] and len(wheel) == 0
+
+
+def test_timing_wheel_sleeps():
+    evloop = EventLoop.new()
+    wheel = TimingWheel(evloop, resolution=0.01)
+    start = evloop.loop.time()
+    wheel.add(Timer(wheel, start + 100, None))
+    # woken for the cascade of the far timer, not at every tick
+    assert wheel.handle.when() > start + 97
+    wheel.add(Timer(wheel, start + 0.5, None))
+    assert start + 0.5 <= wheel.handle.when() < start + 0.52
+    evloop.loop.close()
+
+
+def test_timing_wheel_callback_error():
+    evloop = EventLoop.new()
+    loop = evloop.loop
+    errors = []
+    loop.set_exception_handler(lambda loop, context: errors.append(context))
+    fired = []
+
+    def fail():
+        raise RuntimeError('boom')
+
+    evloop.later(0.02, fail)
+    evloop.later(0.02, fired.append, 'same slot')
+    evloop.later(0.05, fired.append, 'later')
+    loop.run_until_complete(asyncio.sleep(0.1))
+    assert fired == ['same slot', 'later']
+    assert len(evloop.timers) == 0
+    assert [type(error['exception']) for error in errors] == [RuntimeError]
+    loop.close()
+
+
+def test_later_short_delay():
+    result = []
+    @behavior
+    def beh(self, message):
+        result.append(message)
+
+    actor = runtime.create(beh)
+    later(actor, 0.001, 'kept')
+    later(actor, 0.001, 'dropped').cancel()
+    assert len(EventLoop().timers) == 0
+    EventLoop().loop.run_until_complete(asyncio.sleep(0.005))
+    assert result == ['kept']
+
+
+def test_ask_async():
+    actor = runtime.create(double_beh)
+
+    async def f():
+        return await ask_async(actor, {'x': 2})
+
+    assert EventLoop().loop.run_until_complete(f()) == 4
+
+
+def test_actor_map_unchanged():
+    message = {'tag': 'x', 'values': [1, (2, 'three')], 'data': b'abc'}
+    assert actor_map(lambda actor: None, message) is message
+
+
+def test_actor_map_substitution():
+    @behavior
+    def null_beh(self, message):
+        pass
+
+    actor = runtime.create(null_beh)
+    inner = {'k': 'v'}
+    message = {'a': 1, 'b': [inner, actor], 'c': actor, 'd': inner}
+    result = actor_map(lambda actor: 'replaced', message)
+    assert result == {'a': 1, 'b': [{'k': 'v'}, 'replaced'],
+                      'c': 'replaced', 'd': {'k': 'v'}}
+    assert result['d'] is inner
+    assert message['c'] is actor
+
+
+def test_actor_map_unsliceable_sequence():
+    @behavior
+    def null_beh(self, message):
+        pass
+
+    actor = runtime.create(null_beh)
+    result = actor_map(lambda actor: 'replaced', deque([1, actor, 2]))
+    assert result == [1, 'replaced', 2]
+
+
+def test_dict_map_predicate():
+    result = dict_map(lambda x: x * 10, lambda x: type(x) is int,
+                      {'a': [1, 'b'], 'c': 'd'})
+    assert result == {'a': [10, 'b'], 'c': 'd'}
+
+
+def test_instrumentation():
+    class InstrumentedRuntime(SimpleRuntime):
+        pass
+
+    @behavior
+    def count_beh(self, message):
+        pass
+
+    @behavior
+    def error_beh(self, message):
+        1/0
+
+    test_rt = InstrumentedRuntime()
+    test_rt.throw = lambda message: None
+    plain = test_rt.create(count_beh)
+    instrumentation = test_rt.instrument()
+    counter = test_rt.create(count_beh)
+    for i in range(3):
+        counter << i
+    plain << 0
+    test_rt.create(error_beh) << None
+    snapshot = instrumentation.snapshot()
+    assert snapshot['queue_depth'] == 4
+    assert snapshot['backlog'][0] == (repr(counter), 3)
+
+    EventLoop().run_once()
+    snapshot = instrumentation.snapshot()
+    assert snapshot['queue_depth'] == 0
+    assert snapshot['backlog'] == []
+    stats = {name.rsplit('.', 1)[-1]: entry
+             for name, entry in snapshot['behaviors'].items()}
+    assert stats['count_beh']['messages'] == 3
+    assert sum(stats['count_beh']['histogram_us'].values()) == 3
+    assert stats['error_beh']['errors'] == 1
+
+    test_rt.instrument(False)
+    assert type(test_rt.create(count_beh)) is not type(counter)
+
+
+def test_instrumentation_threads():
+    threaded = ThreadedRuntime(EventLoop.new())
+    try:
+        instrumentation = threaded.instrument()
+        done = threading.Event()
+
+        @raw_behavior
+        def count_beh(self, message):
+            if message == 'last':
+                done.set()
+
+        actor = threaded.create(count_beh)
+
+        def produce():
+            for i in range(10000):
+                actor << i
+
+        producers = [threading.Thread(target=produce) for k in range(4)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        actor << 'last'
+        assert done.wait(5)
+        assert instrumentation.sent_count == 40001
+        assert instrumentation.snapshot()['queue_depth'] == 0
+    finally:
+        threaded.pause()
+
+
+def test_async_behavior_holds_messages():
+    result = []
+
+    @async_behavior
+    async def slow_beh(self, message):
+        await asyncio.sleep(0.01)
+        result.append(('slow', message))
+        self.become(fast_beh)
+
+    @behavior
+    def fast_beh(self, message):
+        result.append(('fast', message))
+        if message == 2:
+            self.become(slow_beh)
+
+    actor = runtime.create(slow_beh)
+    for i in range(5):
+        actor << i
+    EventLoop().loop.run_until_complete(asyncio.sleep(0.1))
+    assert result == [('slow', 0), ('fast', 1), ('fast', 2), ('slow', 3),
+                      ('fast', 4)]
+    assert type(actor) is type(runtime.create(fast_beh))
+
+
+def test_async_behavior_fused_replay():
+    result = []
+    nesting = [0, 0]
+
+    @async_behavior
+    async def slow_beh(echo, self, message):
+        await asyncio.sleep(0.01)
+        self.become(fast_beh, echo)
+
+    @behavior
+    def fast_beh(echo, self, message):
+        nesting[0] += 1
+        nesting[1] = max(nesting)
+        result.append(message)
+        if isinstance(message, int):
+            echo << (self, 'echo {}'.format(message))
+        nesting[0] -= 1
+
+    @raw_behavior
+    def echo_beh(self, message):
+        customer, reply = message
+        customer << reply
+
+    fused = FusedRuntime()
+    echo = fused.create(echo_beh)
+    actor = fused.create(slow_beh, echo)
+    for i in range(3):
+        actor << i
+    EventLoop().loop.run_until_complete(asyncio.sleep(0.1))
+    assert nesting[1] == 1
+    assert result == [1, 2, 'echo 1', 'echo 2']
+
+
+def test_async_behavior_instrumented():
+    class InstrumentedRuntime(SimpleRuntime):
+        pass
+
+    @async_behavior
+    async def slow_beh(self, message):
+        await asyncio.sleep(0.01)
+        self.become(fast_beh)
+
+    @behavior
+    def fast_beh(self, message):
+        pass
+
+    test_rt = InstrumentedRuntime()
+    instrumentation = test_rt.instrument()
+    actor = test_rt.create(slow_beh)
+    for i in range(3):
+        actor << i
+    EventLoop().loop.run_until_complete(asyncio.sleep(0.1))
+    snapshot = instrumentation.snapshot()
+    counts = {name.rsplit('.', 1)[-1]: entry['messages']
+              for name, entry in snapshot['behaviors'].items()}
+    assert counts == {'slow_beh': 1, 'fast_beh': 2}
+    assert snapshot['queue_depth'] == 0
+
+
+def test_async_behavior_error():
+    errors = []
+
+    class TestRuntime(SimpleRuntime):
+
+        def throw(self, message):
+            errors.append(message['exception']['type'])
+
+    @async_behavior
+    async def beh(self, message):
+        await asyncio.sleep(0)
+        1/0
+
+    TestRuntime().create(beh) << 1
+    EventLoop().loop.run_until_complete(asyncio.sleep(0.05))
+    assert errors == [ZeroDivisionError]
+
+
+def test_offload():
+    caller = []
+
+    def blocking(x):
+        caller.append(threading.get_ident())
+        return x * 2
+
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        worker = runtime.create(offload_beh, executor, blocking)
+        future = ask(worker, {'args': [21]})
+        EventLoop().loop.run_until_complete(asyncio.sleep(0.05))
+        assert future.result(0) == 42
+    assert caller != [threading.get_ident()]
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('drop_newest', [0, 1]),
+    ('drop_oldest', [3, 4]),
+])
+def test_bounded_drop(policy, expected):
+    result = []
+    @behavior
+    def beh(self, message):
+        result.append(message)
+
+    actor = runtime.create_bounded(2, policy, beh)
+    for i in range(5):
+        actor << i
+    EventLoop().run_once()
+    assert result == expected
+    assert stats(actor)['dropped'] == 3 and stats(actor)['pending'] == 0
+
+
+@pytest.mark.parametrize('policy, expected', [
+    ('drop_newest', [0]),
+    ('drop_oldest', [1]),
+    ('reject', [0]),
+    ('block', [0]),
+])
+def test_bounded_capacity_one(policy, expected):
+    result = []
+    @behavior
+    def beh(self, message):
+        result.append(message)
+
+    loop = EventLoop().loop
+    handler = loop.get_exception_handler()
+    errors = []
+    loop.set_exception_handler(lambda loop, context: errors.append(context))
+    try:
+        batched = BatchedRuntime()
+        actor = batched.create_bounded(1, policy, beh)
+        for i in range(2):
+            try:
+                actor << i
+            except MailboxFull:
+                pass
+        EventLoop().run_once()
+        assert result == expected
+        # the runtime still delivers
+        actor << 'after'
+        batched.create(beh) << 'other'
+        EventLoop().run_once()
+        assert result == expected + ['after', 'other']
+        assert errors == []
+    finally:
+        loop.set_exception_handler(handler)
+
+
+def test_bounded_drop_oldest_releases():
+    class Item(object):
+        pass
+
+    @behavior
+    def beh(self, message):
+        pass
+
+    actor = runtime.create_bounded(2, 'drop_oldest', beh)
+    refs = []
+    for i in range(5):
+        item = Item()
+        refs.append(weakref.ref(item))
+        actor << item
+    del item
+    gc.collect()
+    # the dropped messages are gone before the loop runs
+    assert [ref() is None for ref in refs] == [True] * 3 + [False] * 2
+    EventLoop().run_once()
+
+
+def test_bounded_block_without_loop_thread():
+    @behavior
+    def beh(self, message):
+        pass
+
+    actor = runtime.create_bounded(1, 'block', beh)
+    actor << 0
+    with pytest.raises(MailboxFull):
+        actor << 1
+    assert stats(actor)['rejected'] == 1
+    EventLoop().run_once()
+
+
+def test_bounded_reject():
+    errors = []
+
+    class TestRuntime(BatchedRuntime):
+
+        def throw(self, message):
+            errors.append(message['exception']['type'])
+
+    @behavior
+    def sink(self, message):
+        pass
+
+    @behavior
+    def producer_beh(target, self, message):
+        for i in range(3):
+            target << i
+
+    test_rt = TestRuntime()
+    target = test_rt.create_bounded(2, 'reject', sink)
+    test_rt.create(producer_beh, target) << 'go'
+    EventLoop().run_once()
+    assert errors == [MailboxFull]
+    assert stats(target)['rejected'] == 1
+
+
+def test_bounded_block():
+    threaded = ThreadedRuntime(EventLoop.new())
+    try:
+        received = []
+        done = threading.Event()
+
+        @behavior
+        def slow_beh(self, message):
+            time.sleep(0.001)
+            received.append(message)
+            if message == 19:
+                done.set()
+
+        actor = threaded.create_bounded(2, 'block', slow_beh)
+        for i in range(20):
+            actor << i
+        assert done.wait(5)
+        assert received == list(range(20))
+        assert stats(actor)['deferred'] > 0
+        assert stats(actor)['dropped'] == 0
+    finally:
+        threaded.pause()
+
+
+def test_customer_one_shot():
+    result = []
+    @behavior
+    def beh(tag, self, message):
+        result.append((tag, message))
+
+    customer = runtime.customer(beh, 'c')
+    customer << 1
+    customer << 2
+    EventLoop().run_once()
+    assert result == [('c', 1)]
+
+
+def test_customer_releases_args():
+    result = []
+    @behavior
+    def beh(tag, self, message):
+        result.append((tag, message))
+
+    customer = runtime.customer(beh, 'c')
+    customer << 1
+    EventLoop().run_once()
+    assert result == [('c', 1)]
+    assert customer._args == ()
+
+
+def test_factorial_with_customers():
+    from tartpy.factorial import factorial_beh
+    fac = runtime.create(factorial_beh)
+    future = ask(fac, lambda customer: (customer, 10))
+    for _ in range(25):
+        EventLoop().run_once()
+    assert future.result(0) == 3628800
+
+
+def test_fused_direct_delivery():
+    result = []
+    @behavior
+    def beh(self, message):
+        result.append(message)
+
+    fused = FusedRuntime()
+    actor = fused.create(beh)
+    actor << 1
+    assert result == [1]
+
+
+def test_fused_order_and_depth():
+    result = []
+    depths = []
+    fused = FusedRuntime()
+
+    @behavior
+    def chain_beh(n, self, message):
+        depths.append(fused.dispatcher.depth)
+        if n:
+            self.create(chain_beh, n - 1) << message
+
+    @behavior
+    def echo_beh(self, message):
+        result.append(message)
+        if message < 3:
+            # busy: queued behind the current message
+            self << message + 10
+
+    fused.create(chain_beh, 20) << 'x'
+    assert depths == list(range(1, fused.max_depth + 1))
+    actor = fused.create(echo_beh)
+    actor << 0
+    actor << 1
+    EventLoop().run_once()
+    assert len(depths) == 21 and max(depths) == fused.max_depth
+    assert result == [0, 10, 1, 11]
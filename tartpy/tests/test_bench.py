@@ -0,0 +1,50 @@
+import pytest
+
+from tartpy import bench
+from tartpy.bench import (compare, percentile, params_for, run,
+                          ScenarioFailed)
+from tartpy.bench.scenarios import SCENARIOS
+
+
+def result(rate, p99, rss):
+    return {'msgs_per_sec': rate,
+            'latency_ms': None if p99 is None else {'p99': p99},
+            'peak_rss_kb': rss}
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 51
+    assert percentile(values, 99) == 99
+    assert percentile([3], 90) == 3
+
+
+def test_params_for():
+    assert params_for('ring', 0.1) == {'m': 10000, 'n': 1}
+
+
+def test_compare():
+    baseline = {'ring': result(100, 10, 1000),
+                'flipflop': result(100, None, 1000)}
+    results = {'ring': result(95, 12, 1000),
+               'flipflop': result(50, None, 1000),
+               'membrane': result(1, 1, 1)}
+    regressions = compare(results, baseline, tolerance=0.1)
+    assert {(r['scenario'], r['metric']) for r in regressions} == {
+        ('ring', 'latency_ms.p99'), ('flipflop', 'msgs_per_sec')}
+
+
+def test_run_failed(monkeypatch):
+    # not registered in the scenario process, which fails to find it
+    monkeypatch.setitem(SCENARIOS, 'missing', (None, {}))
+    monkeypatch.setattr(bench, 'POLL_INTERVAL', 0.1)
+    with pytest.raises(ScenarioFailed):
+        run('missing')
+
+
+@pytest.mark.parametrize('name', ['ring', 'serial'])
+def test_scenario_in_process(name):
+    f, defaults = SCENARIOS[name]
+    result = f(**params_for(name, 0.001))
+    assert result['messages'] > 0
+    assert len(result['latencies']) == params_for(name, 0.001)['n']
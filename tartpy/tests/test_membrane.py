@@ -1,4 +1,5 @@
 from collections.abc import Mapping
+import gc
 
 import pytest
 
@@ -73,3 +74,41 @@ def test_membrane_protocol():
     evloop.run_once()
     assert result2 == 'a string message'
 
+
+def test_membrane_tables_are_weak():
+    runtime = SimpleRuntime()
+    membrane_inst = MembraneFactory()
+    this = runtime.create(membrane_inst.membrane_beh)
+
+    @behavior
+    def null_beh(self, msg):
+        pass
+
+    actor = runtime.create(null_beh)
+    proxy = membrane_inst._create_proxy(this, actor)
+    assert membrane_inst._create_proxy(this, actor) is proxy
+    assert membrane_inst.stats()['size'] == 1
+
+    del proxy
+    gc.collect()
+    stats = membrane_inst.stats()
+    assert stats['size'] == 0
+    assert stats['created'] == 1 and stats['reused'] == 1
+    assert stats['collected'] == 1
+
+
+def test_membrane_lru():
+    runtime = SimpleRuntime()
+    membrane_inst = MembraneFactory(max_proxies=2)
+    this = runtime.create(membrane_inst.membrane_beh)
+
+    @behavior
+    def null_beh(self, msg):
+        pass
+
+    actors = [runtime.create(null_beh) for i in range(3)]
+    proxies = [membrane_inst._create_proxy(this, actor) for actor in actors]
+    assert membrane_inst.stats()['size'] == 2
+    assert membrane_inst.stats()['evicted'] == 1
+    assert not membrane_inst._is_proxy(proxies[0])
+    assert membrane_inst._create_proxy(this, actors[2]) is proxies[2]
@@ -0,0 +1,548 @@
+import concurrent.futures
+import gc
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from tartpy.eventloop import EventLoop
+from tartpy import shm
+from tartpy.network import (NetworkRuntime, ShmClient, TCPServerProtocol,
+                            shm_socket_path)
+from tartpy.runtime import raw_behavior
+from tartpy.shm import ShmRing
+from tartpy.tools import ask
+from tartpy.wire import (ActorRef, FrameReader, HEADER, frame, offer,
+                         choose)
+
+
+class TrustedRuntime(NetworkRuntime):
+    codecs = ('pickle-oob', 'pickle', 'json')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+needs_shm = pytest.mark.skipif(not shm.SUPPORTED,
+                               reason='shared memory rings need x86')
+
+
+@needs_shm
+def test_shm_ring_wraps():
+    ring = ShmRing(capacity=16)
+    peer = ShmRing(ring.name)
+    reader = FrameReader()
+    try:
+        payloads = []
+        for i in range(10):
+            data = frame(bytes([i]) * 5)
+            assert ring.write(data) == len(data)
+            payloads.extend(peer.read_into(reader))
+        assert [bytes(p) for p in payloads] == [bytes([i]) * 5
+                                                for i in range(10)]
+        assert ring.write(b'x' * 20) == 16 and ring.write(b'y') == 0
+        assert len(peer) == 16
+    finally:
+        peer.close()
+        ring.close()
+
+
+@needs_shm
+def test_shm_ring_checked():
+    ring = ShmRing(capacity=16)
+    try:
+        COUNTER = shm.COUNTER
+        COUNTER.pack_into(ring.buf, shm.CAPACITY, 1 << 20)
+        with pytest.raises(ValueError):
+            ShmRing(ring.name)
+        COUNTER.pack_into(ring.buf, shm.CAPACITY, 16)
+        if os.getuid() == 0:
+            os.fchown(ring.shm._fd, 12345, -1)
+            with pytest.raises(PermissionError):
+                ShmRing(ring.name)
+    finally:
+        ring.close()
+
+
+def test_shm_socket_private(monkeypatch, tmp_path):
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    path = shm_socket_path('shm://node')
+    directory = os.path.dirname(path)
+    assert directory == str(tmp_path / 'tartpy-{}'.format(os.getuid()))
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+    os.chmod(directory, 0o755)
+    with pytest.raises(PermissionError):
+        shm_socket_path('shm://node')
+
+
+def test_json_by_default():
+    offered, = FrameReader().feed(offer(['pickle-oob', 'pickle', 'json']))
+    assert choose(offered, NetworkRuntime.codecs) == 'json'
+    assert choose(offered, TrustedRuntime.codecs) == 'pickle-oob'
+
+
+@raw_behavior
+def echo_beh(self, message):
+    message['customer'] << message['data']
+
+
+@pytest.mark.parametrize('scheme', ['tcp', 'unix',
+                                    pytest.param('shm', marks=needs_shm)])
+def test_transports(scheme, tmp_path):
+    if scheme == 'tcp':
+        urls = ['tcp://localhost:{}'.format(free_port()) for name in 'ab']
+    elif scheme == 'unix':
+        urls = ['unix://{}'.format(tmp_path / name) for name in 'ab']
+    else:
+        urls = ['shm://tartpy-test-{}-{}'.format(os.getpid(), name)
+                for name in 'ab']
+    a, b = [TrustedRuntime(url, EventLoop.new()) for url in urls]
+    try:
+        echo = b.create(echo_beh)
+        proxy = a.actor_for_uid(b.url, b.uid_for_actor(echo))
+        big = b'z' * (100 * 1024)
+        futures = [ask(proxy, {'data': data}, timeout=5)
+                   for data in [b'small', big] * 50]
+        results = [bytes(f.result(5)) for f in futures]
+        assert results == [b'small', big] * 50
+    finally:
+        a.pause()
+        b.pause()
+
+
+@needs_shm
+def test_shm_ring_full(monkeypatch):
+    # frames larger than the ring, written in several rounds
+    monkeypatch.setattr(ShmClient, 'ring_size', 4096)
+    a, b = [TrustedRuntime('shm://tartpy-test-{}-full-{}'
+                           .format(os.getpid(), name), EventLoop.new())
+            for name in 'ab']
+    try:
+        echo = b.create(echo_beh)
+        proxy = a.actor_for_uid(b.url, b.uid_for_actor(echo))
+        futures = [ask(proxy, {'data': bytes([i]) * 10000}, timeout=5)
+                   for i in range(50)]
+        assert [bytes(f.result(5)) for f in futures] == [
+            bytes([i]) * 10000 for i in range(50)]
+    finally:
+        a.pause()
+        b.pause()
+
+
+class BatchedNetworkRuntime(NetworkRuntime):
+    batched = True
+    batch_size = 1
+
+
+def test_credit_flow_control(tmp_path):
+    a = NetworkRuntime('unix://{}'.format(tmp_path / 'a'), EventLoop.new())
+    b = BatchedNetworkRuntime('unix://{}'.format(tmp_path / 'b'),
+                              EventLoop.new())
+    b.credit_window = 8
+    received = []
+    inflight = []
+    done = threading.Event()
+
+    @raw_behavior
+    def sink_beh(self, message):
+        received.append(message)
+        if len(received) == 200:
+            done.set()
+
+    receive_messages = b.server.receive_messages
+    count = [0]
+
+    def counting_receive(messages):
+        count[0] += len(messages)
+        inflight.append(count[0] - len(received))
+        return receive_messages(messages)
+
+    b.server.receive_messages = counting_receive
+    try:
+        sink = b.create(sink_beh)
+        proxy = a.actor_for_uid(b.url, b.uid_for_actor(sink))
+        for i in range(200):
+            proxy << i
+        assert done.wait(5)
+        assert received == list(range(200))
+        # never more than a window of messages waiting in the server
+        assert max(inflight) <= 8
+        stats = a.flow_stats()[b.url]
+        assert stats['backlog'] == 0 and stats['dropped'] == 0
+        # the last grants may still be on their way
+        assert stats['credits'] <= 8
+    finally:
+        a.pause()
+        b.pause()
+
+
+def test_credits_with_busy_target(tmp_path):
+    a = NetworkRuntime('unix://{}'.format(tmp_path / 'a'), EventLoop.new())
+    b = BatchedNetworkRuntime('unix://{}'.format(tmp_path / 'b'),
+                              EventLoop.new())
+    b.credit_window = 8
+    received = []
+    done = threading.Event()
+
+    @raw_behavior
+    def busy_beh(self, message):
+        # the mailbox never empties until all the messages arrived
+        if message != 'tick':
+            received.append(message)
+            if len(received) == 25:
+                done.set()
+        if not done.is_set():
+            self << 'tick'
+
+    try:
+        busy = b.create(busy_beh)
+        busy << 'tick'
+        proxy = a.actor_for_uid(b.url, b.uid_for_actor(busy))
+        for i in range(25):
+            proxy << i
+        assert done.wait(5)
+        assert received == list(range(25))
+        assert a.flow_stats()[b.url]['backlog'] == 0
+    finally:
+        a.pause()
+        b.pause()
+
+
+def test_control_outside_credits(tmp_path, monkeypatch):
+    a, b = [NetworkRuntime('unix://{}'.format(tmp_path / name),
+                           EventLoop.new()) for name in 'ab']
+    b.credit_window = 2
+    # no credits granted back
+    monkeypatch.setattr(TCPServerProtocol, 'consumed', lambda self, n: None)
+    received = []
+    controls = []
+    done = threading.Event()
+
+    @raw_behavior
+    def sink_beh(self, message):
+        received.append(message)
+
+    def receive_control(message):
+        controls.append(message)
+        done.set()
+
+    b.receive_control = receive_control
+    try:
+        sink = b.create(sink_beh)
+        proxy = a.actor_for_uid(b.url, b.uid_for_actor(sink))
+        client = a.network_client(b.url)
+        client.max_backlog = 4
+        deadline = time.time() + 5
+
+        def wait_for(condition):
+            while not condition() and time.time() < deadline:
+                time.sleep(0.01)
+
+        # use up the credits, then fill the backlog
+        proxy << 0
+        proxy << 1
+        wait_for(lambda: len(received) == 2)
+        for i in range(2, 10):
+            proxy << i
+        wait_for(lambda: a.flow_stats()[b.url]['dropped'] == 4)
+        a.loop.thread_do(a.network_send_control, b.url,
+                         {'_release': 'x', '_weight': 1})
+        time.sleep(0.1)
+        # kept behind the backlog, even full
+        stats = a.flow_stats()[b.url]
+        assert stats['backlog'] == 5 and stats['dropped'] == 4
+        assert controls == [] and received == [0, 1]
+        # and sent with the backlog, taking no credits
+        a.loop.thread_do(client.grant, 4)
+        assert done.wait(5)
+        assert controls == [{'_release': 'x', '_weight': 1}]
+        assert a.flow_stats()[b.url]['backlog'] == 0
+    finally:
+        a.pause()
+        b.pause()
+
+
+def test_oversized_frame_dropped():
+    runtime = NetworkRuntime('tcp://localhost:{}'.format(free_port()),
+                             EventLoop.new())
+    try:
+        with socket.create_connection(('localhost', runtime.server.port),
+                                      timeout=5) as sock:
+            sock.sendall(offer(['json']))
+            received = sock.recv(4096)
+            sock.sendall(HEADER.pack(2 ** 31))
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                received += data
+        # the handshake answer, then the connection is closed
+        assert received.startswith(frame(b'json'))
+    finally:
+        runtime.pause()
+
+
+def test_lost_counts_messages(tmp_path):
+    errors = []
+
+    class TestRuntime(NetworkRuntime):
+
+        def throw(self, message):
+            errors.append(message)
+
+    a, b = [TestRuntime('unix://{}'.format(tmp_path / name),
+                        EventLoop.new()) for name in 'ab']
+    try:
+        echo = b.create(echo_beh)
+        proxy = a.actor_for_uid(b.url, b.uid_for_actor(echo))
+        assert ask(proxy, {'data': 1}).result(5) == 1
+        client = a.clients[b.url]
+        future = concurrent.futures.Future()
+
+        def fail():
+            for i in range(3):
+                client.write({'_to': 'x', '_msg': i})
+            client.failed('test')
+            future.set_result(None)
+
+        a.loop.loop.call_soon_threadsafe(fail)
+        future.result(5)
+        assert [error['lost'] for error in errors] == [3]
+    finally:
+        a.pause()
+        b.pause()
+
+
+def test_unencodable_message_skipped(tmp_path):
+    errors = []
+
+    class TestRuntime(NetworkRuntime):
+
+        def throw(self, message):
+            errors.append(message)
+
+    a, b = [TestRuntime('unix://{}'.format(tmp_path / name),
+                        EventLoop.new()) for name in 'ab']
+    received = []
+    done = threading.Event()
+
+    @raw_behavior
+    def sink_beh(self, message):
+        received.append(message)
+        if len(received) == 2:
+            done.set()
+
+    try:
+        sink = b.create(sink_beh)
+        proxy = a.actor_for_uid(b.url, b.uid_for_actor(sink))
+        # sent before the handshake, encoded after it
+        proxy << {'bad': {1, 2}}
+        proxy << 1
+        proxy << 2
+        assert done.wait(5)
+        assert received == [1, 2]
+        assert [error['error'] for error in errors] == [
+            'cannot encode message to {}'.format(b.url)]
+        assert errors[0]['exception']['type'] is TypeError
+    finally:
+        a.pause()
+        b.pause()
+
+
+def test_server_start_from_loop(tmp_path):
+    a, b = [NetworkRuntime('unix://{}'.format(tmp_path / name),
+                           EventLoop.new()) for name in 'ab']
+    started = concurrent.futures.Future()
+
+    def restart():
+        a.server.server.close()
+        # must not wait for the loop running it
+        a.server.start()
+        started.set_result(a.server.server)
+
+    try:
+        a.loop.thread_do(restart)
+        assert started.result(5) is None
+        echo = a.create(echo_beh)
+        proxy = b.actor_for_uid(a.url, a.uid_for_actor(echo))
+        assert ask(proxy, {'data': 'x'}, timeout=5).result(5) == 'x'
+    finally:
+        a.pause()
+        b.pause()
+
+
+def test_inbound_batch_submitted_once(tmp_path):
+    runtime = NetworkRuntime('unix://{}'.format(tmp_path / 'a'),
+                             EventLoop.new())
+    received = []
+    done = threading.Event()
+
+    @raw_behavior
+    def sink_beh(self, message):
+        received.append(message)
+        if len(received) == 100:
+            done.set()
+
+    try:
+        uid = runtime.uid_for_actor(runtime.create(sink_beh))
+        submissions = []
+        do = runtime.loop.do
+
+        def counting_do(f, *args):
+            submissions.append(f)
+            do(f, *args)
+
+        runtime.loop.do = counting_do
+        runtime.server.receive_messages([{'_to': uid, '_msg': i}
+                                         for i in range(100)])
+        assert done.wait(5)
+        assert received == list(range(100))
+        assert len(submissions) == 1
+    finally:
+        runtime.pause()
+
+
+def test_mailbox_full_reported(tmp_path):
+    errors = []
+
+    class TestRuntime(NetworkRuntime):
+
+        def throw(self, message):
+            errors.append(message)
+
+    runtime = TestRuntime('unix://{}'.format(tmp_path / 'a'),
+                          EventLoop.new())
+    received = []
+
+    @raw_behavior
+    def sink_beh(self, message):
+        received.append(message)
+
+    try:
+        uid = runtime.uid_for_actor(
+            runtime.create_bounded(2, 'reject', sink_beh))
+        future = concurrent.futures.Future()
+
+        def receive():
+            runtime.server.receive_messages(
+                [{'_to': uid, '_msg': i} for i in range(5)])
+            future.set_result(None)
+
+        runtime.loop.loop.call_soon_threadsafe(receive)
+        future.result(5)
+        assert ask(runtime.create(echo_beh), {'data': 'x'}).result(5) == 'x'
+        assert received == [0, 1]
+        assert len(errors) == 1 and '3 rejected' in errors[0]['error']
+    finally:
+        runtime.pause()
+
+
+def test_proxy_cache(tmp_path):
+    runtime = NetworkRuntime('unix://{}'.format(tmp_path / 'a'),
+                             EventLoop.new())
+    try:
+        remote = 'unix://{}'.format(tmp_path / 'b')
+        proxy = runtime.actor_for_uid(remote, 'x')
+        assert runtime.actor_for_uid(remote, 'x') is proxy
+        other = runtime.actor_for_uid(remote, 'y')
+        assert other is not proxy
+        stats = runtime.reference_stats()
+        assert stats['proxy_hits'] == 1 and stats['proxy_misses'] == 2
+        assert stats['imported'] == 2
+    finally:
+        runtime.pause()
+
+
+def test_unknown_uid_in_message(tmp_path):
+    runtime = NetworkRuntime('unix://{}'.format(tmp_path / 'a'),
+                             EventLoop.new())
+    errors = []
+    runtime.throw = errors.append
+    received = []
+    done = threading.Event()
+
+    @raw_behavior
+    def sink_beh(self, message):
+        received.append(message)
+        done.set()
+
+    try:
+        uid = runtime.uid_for_actor(runtime.create(sink_beh))
+        runtime.server.receive_messages([
+            {'_to': uid, '_msg': {'customer': ActorRef(runtime.url, 'x')}},
+            {'_to': 'y', '_msg': 1},
+            {'_to': uid, '_msg': 2}])
+        assert done.wait(5)
+        assert received == [2]
+        assert [error['error'] for error in errors] == [
+            "unknown uid 'x' in message to '{}'".format(uid),
+            "unknown uid 'y'"]
+    finally:
+        runtime.pause()
+
+
+def test_release_and_collect(tmp_path):
+    runtime = NetworkRuntime('unix://{}'.format(tmp_path / 'a'),
+                             EventLoop.new())
+    try:
+        weight = runtime.EXPORT_WEIGHT
+        exported = runtime.create(echo_beh)
+        ref = runtime.marshall_actor(exported)
+        assert ref.weight == weight
+        runtime.release(ref.uid, weight // 2)
+        assert runtime.reference_stats()['exported'] == 1
+        runtime.release(ref.uid, weight - weight // 2)
+        stats = runtime.reference_stats()
+        assert stats['exported'] == 0 and stats['released'] == 1
+
+        pinned = runtime.create(echo_beh)
+        uid = runtime.uid_for_actor(pinned)
+        runtime.release(uid, runtime.marshall_actor(pinned).weight)
+        assert runtime.actor_for_uid(runtime.url, uid) is pinned
+        assert runtime.reference_stats()['released'] == 1
+    finally:
+        runtime.pause()
+
+
+def test_max_exports_keeps_pinned(tmp_path):
+    runtime = NetworkRuntime('unix://{}'.format(tmp_path / 'a'),
+                             EventLoop.new())
+    runtime.max_exports = 2
+    try:
+        pinned = runtime.create(echo_beh)
+        pinned_uid = runtime.uid_for_actor(pinned)
+        actors = [runtime.create(echo_beh) for i in range(3)]
+        uids = [runtime.marshall_actor(actor).uid for actor in actors]
+        stats = runtime.reference_stats()
+        assert stats['exported'] == 3 and stats['evicted'] == 1
+        assert runtime.actor_for_uid(runtime.url, pinned_uid) is pinned
+        assert runtime.actor_for_uid(runtime.url, uids[0]) is None
+        assert runtime.actor_for_uid(runtime.url, uids[2]) is actors[2]
+    finally:
+        runtime.pause()
+
+
+def test_remote_references_collected(tmp_path):
+    a, b = [NetworkRuntime('unix://{}'.format(tmp_path / name),
+                           EventLoop.new()) for name in 'ab']
+    try:
+        echo = b.create(echo_beh)
+        proxy = a.actor_for_uid(b.url, b.uid_for_actor(echo))
+        # exports a customer to b, which drops it after replying
+        assert ask(proxy, {'data': 'x'}, timeout=5).result(5) == 'x'
+        deadline = time.time() + 5
+        while (a.reference_stats()['released'] == 0 and
+               time.time() < deadline):
+            gc.collect()
+            time.sleep(0.01)
+        stats = a.reference_stats()
+        assert stats['released'] == 1 and stats['exported'] == 0
+    finally:
+        a.pause()
+        b.pause()
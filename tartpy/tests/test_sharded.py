@@ -0,0 +1,119 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from tartpy.eventloop import EventLoop
+from tartpy.runtime import raw_behavior
+from tartpy.sharded import (ShardRuntime, ShardedRuntime, _fib_beh,
+                            behavior_name, spawnable, spawner_uid)
+from tartpy.tools import Wait, sink_beh
+
+
+@spawnable
+@raw_behavior
+def spawned_beh(self, message):
+    pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def test_pending_messages_first(tmp_path):
+    url = 'unix://{}'.format(tmp_path / 'shard')
+    shard = ShardRuntime(url, [url], evloop=EventLoop.new())
+    received = []
+    done = threading.Event()
+
+    @raw_behavior
+    def record_beh(self, message):
+        received.append(message)
+        if len(received) == 3:
+            done.set()
+
+    def early():
+        # messages reaching the shard before the spawn request
+        placeholder = shard.actor_for_uid(url, 'x')
+        placeholder << 0
+        placeholder << 1
+        # after the placeholder held them
+        shard.loop.loop.call_soon(spawn)
+
+    def spawn():
+        shard.actor_for_uid(url, 'x') << 2
+        shard.create_local(record_beh, uid='x')
+
+    try:
+        shard.loop.thread_do(early)
+        assert done.wait(5)
+        assert received == [0, 1, 2]
+    finally:
+        shard.pause()
+
+
+def test_release_before_spawn(tmp_path):
+    url = 'unix://{}'.format(tmp_path / 'shard')
+    shard = ShardRuntime(url, [url], evloop=EventLoop.new())
+    shard.max_exports = 0
+    try:
+        weight = shard.EXPORT_WEIGHT
+        # the creator dropped its reference before the spawn arrived
+        shard.loop.thread_do(shard.release, 'x', weight)
+        shard.actor_for_uid(url, spawner_uid(url)) << {
+            'behavior': behavior_name(spawned_beh), 'args': [], 'uid': 'x',
+            'weight': weight}
+        deadline = time.time() + 5
+        while (shard.reference_stats()['released'] == 0 and
+               time.time() < deadline):
+            time.sleep(0.01)
+        stats = shard.reference_stats()
+        assert stats['released'] == 1 and stats['exported'] == 1
+        # the spawner is never evicted
+        spawner = shard.uid_to_actor[spawner_uid(url)]
+        shard.marshall_actor(shard.create_local(sink_beh))
+        assert shard.uid_to_actor[spawner_uid(url)] is spawner
+        assert shard.reference_stats()['evicted'] == 0
+    finally:
+        shard.pause()
+
+
+def test_spawn_only_registered(tmp_path):
+    errors = []
+
+    class TestRuntime(ShardRuntime):
+
+        def throw(self, message):
+            errors.append(message)
+
+    url = 'unix://{}'.format(tmp_path / 'shard')
+    other = 'unix://{}'.format(tmp_path / 'other')
+    shard = TestRuntime(url, [url, other], evloop=EventLoop.new())
+    try:
+        shard.actor_for_uid(url, spawner_uid(url)) << {
+            'behavior': 'os:system', 'args': ['true'], 'uid': 'x',
+            'weight': shard.EXPORT_WEIGHT}
+        deadline = time.time() + 5
+        while not errors and time.time() < deadline:
+            time.sleep(0.01)
+        assert errors == [{'error': "behavior 'os:system' is not spawnable"}]
+        assert 'x' not in shard.uid_to_actor
+        with pytest.raises(ValueError):
+            shard.create_on(1, sink_beh)
+    finally:
+        shard.pause()
+
+
+def test_sharded_fib():
+    runtime = ShardedRuntime('tcp://localhost:{}'.format(free_port()), 2,
+                             evloop=EventLoop.new())
+    try:
+        w = Wait(timeout=30)
+        wait = runtime.create_local(w.wait_beh)
+        runtime.create(_fib_beh) << (wait, 10)
+        assert w.join() == 55
+    finally:
+        runtime.shutdown()
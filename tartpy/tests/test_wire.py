@@ -0,0 +1,142 @@
+import pickle
+
+import pytest
+
+from tartpy.runtime import Message
+
+from tartpy.wire import (ActorRef, CODECS, JSONCodec, PickleCodec,
+                         PickleOOBCodec, frame, frame_parts, FrameReader,
+                         FrameTooLarge, HEADER, offer, choose)
+
+
+@pytest.mark.parametrize('codec', [JSONCodec(), PickleCodec(),
+                                   PickleOOBCodec()])
+def test_codec_roundtrip(codec):
+    message = {'_to': 'abc',
+               '_msg': {'customer': ActorRef('tcp://localhost:1', 'x'),
+                        'values': [1, 'two', ActorRef('tcp://h:2', 'y')]}}
+    assert codec.decode(codec.encode(message)) == message
+
+
+@pytest.mark.parametrize('codec', [JSONCodec(), PickleCodec(),
+                                   PickleOOBCodec()])
+def test_codec_weight(codec):
+    ref = codec.decode(codec.encode(ActorRef('tcp://localhost:1', 'x', 8)))
+    assert ref.weight == 8
+
+
+def test_pickle_codec_bytes():
+    codec = PickleCodec()
+    assert codec.decode(codec.encode({'data': b'\x00\x01'})) == {
+        'data': b'\x00\x01'}
+
+
+def test_json_codec_compatible_refs():
+    codec = JSONCodec()
+    data = b'{"_url": "tcp://localhost:1", "_uid": "x"}'
+    ref = codec.decode(data)
+    assert ref == ActorRef('tcp://localhost:1', 'x') and ref.weight == 0
+
+
+def test_json_codec_plain_dicts():
+    codec = JSONCodec()
+    data = b'{"_url": "tcp://localhost:1", "_uid": "x", "tag": 1}'
+    assert codec.decode(data) == {'_url': 'tcp://localhost:1', '_uid': 'x',
+                                  'tag': 1}
+
+
+def test_frames():
+    reader = FrameReader()
+    data = frame(b'foo') + frame(b'') + frame(b'bar') + frame(b'baz')
+    assert reader.feed(data[:10]) == [b'foo']
+    assert reader.feed(data[10:-1]) == [b'', b'bar']
+    assert reader.feed(data[-1:]) == [b'baz']
+    assert reader.feed(b'') == []
+
+
+def test_handshake():
+    offered, = FrameReader().feed(offer(['msgpack', 'json', 'pickle']))
+    assert choose(offered, CODECS) == 'json'
+    assert choose(offered, ['pickle']) == 'pickle'
+    assert choose(offered, []) is None
+
+
+@pytest.mark.parametrize('codec', [JSONCodec(), PickleCodec(),
+                                   PickleOOBCodec()])
+def test_codec_message_view(codec):
+    message = {'_to': 'abc', '_msg': Message({'i': 1})}
+    assert codec.decode(codec.encode(message)) == {'_to': 'abc',
+                                                   '_msg': {'i': 1}}
+
+
+def test_oob_codec_buffers():
+    codec = PickleOOBCodec()
+    big = b'a' * codec.threshold
+    view = memoryview(bytearray(b'b' * 4 * codec.threshold)).cast('I')
+    message = {'big': big, 'view': view, 'small': b'c',
+               'buffer': pickle.PickleBuffer(bytearray(2 * codec.threshold)),
+               'ref': ActorRef('tcp://localhost:1', 'x')}
+    parts = codec.encode_parts(message)
+    # the large buffers are parts of their own, not copied
+    assert parts[2] is big
+    assert parts[3].obj is view.obj
+    payload, = FrameReader().feed(b''.join(frame_parts(parts)))
+    decoded = codec.decode(payload)
+    assert type(decoded['big']) is bytes and decoded['big'] == big
+    # views are rebuilt over the frame
+    assert decoded['view'].obj is payload.obj
+    assert bytes(decoded['view']) == view.tobytes()
+    assert bytes(decoded['buffer']) == bytes(2 * codec.threshold)
+    assert decoded['small'] == b'c'
+    assert decoded['ref'] == message['ref']
+
+
+def test_oob_codec_small_views():
+    codec = PickleOOBCodec()
+    strided = memoryview(b'x' * 2 * codec.threshold)[::2]
+    message = {'view': memoryview(b'abc'),
+               'buffer': pickle.PickleBuffer(b'def'),
+               'strided': strided}
+    parts = codec.encode_parts(message)
+    # only the large view is out of band, copied
+    assert len(parts) == 3
+    decoded = codec.decode(b''.join(parts))
+    assert type(decoded['view']) is memoryview
+    assert bytes(decoded['view']) == b'abc'
+    assert bytes(decoded['buffer']) == b'def'
+    assert bytes(decoded['strided']) == strided.tobytes()
+
+
+def test_oob_codec_bytearray():
+    codec = PickleOOBCodec()
+    data = bytearray(b'a' * codec.threshold)
+    decoded = codec.decode(codec.encode({'data': data}))
+    assert type(decoded['data']) is bytearray and decoded['data'] == data
+
+
+def test_frame_too_large():
+    reader = FrameReader()
+    reader.max_frame_size = 100
+    assert [bytes(p) for p in reader.feed(frame(b'x' * 100))] == [b'x' * 100]
+    with pytest.raises(FrameTooLarge):
+        reader.feed(frame(b'y' * 101))
+    with pytest.raises(FrameTooLarge):
+        FrameReader().feed(HEADER.pack(2 ** 32 - 1))
+
+
+def test_frame_reader_buffers():
+    reader = FrameReader()
+    reader.chunk_size = 16
+    reader.buffer = bytearray(16)
+    data = frame(b'x' * 5) + frame(b'y' * 40) + frame(b'z')
+    frames = []
+    while data:
+        target = reader.get_buffer()
+        n = min(len(target), len(data), 7)
+        target[:n] = data[:n]
+        data = data[n:]
+        frames.extend(reader.buffer_updated(n))
+    assert [bytes(payload) for payload in frames] == [b'x' * 5, b'y' * 40,
+                                                      b'z']
+    # the large frame was read into a buffer of its own size
+    assert len(frames[1].obj) == 44
@@ -1,8 +1,12 @@
+import asyncio
 from collections.abc import Mapping, Sequence
+import concurrent.futures
+import itertools
+import threading
 import time
 
-from .runtime import behavior, Actor, exception_message, Runtime
-from .eventloop import EventLoop
+from .runtime import (behavior, raw_behavior, async_behavior, Actor,
+                      exception_message, Runtime)
 
 
 class Wait(object):
@@ -21,25 +25,113 @@ class Wait(object):
 
     """
 
-    POLL_TIME = 0.01 # seconds
-    
     def __init__(self, timeout=None):
         self.timeout = timeout if timeout is not None else float('inf') # secs
         self.now = time.time()
         self.state = None
+        self.event = threading.Event()
 
     @behavior
     def wait_beh(self, this, message):
         self.state = message
+        self.event.set()
 
     def join(self):
-        while time.time() < self.now + self.timeout and self.state is None:
-            time.sleep(self.POLL_TIME)
+        remaining = self.now + self.timeout - time.time()
+        if self.state is None and remaining > 0:
+            self.event.wait(None if remaining == float('inf') else remaining)
         return self.state
 
 
+_TIMEOUT = object()
+
+
+@behavior
+def future_beh(future, self, message):
+    """One-shot customer completing `future` with the first message."""
+    self.become(sink_beh)
+    if future.done():
+        return
+    if message is _TIMEOUT:
+        future.set_exception(concurrent.futures.TimeoutError())
+    else:
+        future.set_result(message)
+
+
+def ask(actor, message, timeout=None, key='customer'):
+    """Send `message` to `actor` and return a future for the reply.
+
+    A one-shot customer is created for the reply.  If `message` is a
+    mapping, the customer is added to it under `key`; otherwise
+    `message` must be a function taking the customer and returning the
+    message to send.  For example::
+
+        f = ask(fac, lambda customer: (customer, 5))
+        f.result()  # blocks until the reply arrives
+
+    The result is a `concurrent.futures.Future`, which fails with
+    `concurrent.futures.TimeoutError` when no reply arrives within
+    `timeout` seconds.
+
+    """
+    future = concurrent.futures.Future()
+    customer = actor._runtime.customer(future_beh, future)
+    if isinstance(message, Mapping):
+        message = dict(message)
+        message[key] = customer
+    else:
+        message = message(customer)
+    actor << message
+    if timeout is not None:
+        timer = later(customer, timeout, _TIMEOUT)
+        future.add_done_callback(lambda f: timer.cancel())
+    return future
+
+
+def ask_async(actor, message, timeout=None, key='customer'):
+    """Like `ask`, but return an awaitable for asyncio callers."""
+    return asyncio.wrap_future(ask(actor, message, timeout, key))
+
+
+def send_many(actor, messages):
+    """Send every message of the iterable `messages` to `actor`.
+
+    Faster than one ``actor << msg`` per message when injecting from a
+    thread other than the loop's, since the batch wakes the loop once.
+
+    """
+    actor.send_many(messages)
+
+
 def later(actor, t, msg):
-    EventLoop().later(t, lambda: actor << msg)
+    """Send `msg` to `actor` after `t` seconds.
+
+    Return a timer whose `cancel` method drops the message.
+
+    """
+    return actor.send_later(t, msg)
+
+
+@async_behavior
+async def offload_beh(executor, f, self, message):
+    """Run `f` in `executor` and send the result to the customer.
+
+    Create with an executor from `concurrent.futures` (``None`` for the
+    default thread pool of the loop) and a function, as in::
+
+        reader = runtime.create(offload_beh, None, read_file)
+        reader << {'customer': c, 'args': ['data.txt']}
+
+    The function is called with the ``'args'`` of the message (if any)
+    and its result is sent to ``'customer'``.  It must be picklable for
+    a process pool.  The actor runs one call at a time; create several
+    actors to run calls in parallel.
+
+    """
+    loop = self._context.loop.loop
+    result = await loop.run_in_executor(executor, f,
+                                        *message.get('args', ()))
+    message.customer << result
 
 
 @behavior
@@ -47,22 +139,100 @@ def log_beh(self, message):
     print('LOG:', message)
 
 
+@raw_behavior
+def sink_beh(self, message):
+    pass
+
+
+# kinds of nodes in a message
+_LEAF, _PRIMITIVE, _MAPPING, _SEQUENCE = range(4)
+
+# kind of each type, by tuple of primitive types
+_kinds = {}
+
+
+def _classify(t, types):
+    if types and issubclass(t, types):
+        return _PRIMITIVE
+    if issubclass(t, (str, bytes, bytearray, memoryview)):
+        return _LEAF
+    if issubclass(t, Mapping):
+        return _MAPPING
+    if issubclass(t, Sequence):
+        return _SEQUENCE
+    return _LEAF
+
+
+def _mapper(f, primitive, types):
+    """Return a function mapping `f` to a message.
+
+    Nodes satisfying `primitive`, or instances of `types`, are replaced
+    by their image under `f`.  Containers are rebuilt (mappings as
+    dicts, sequences as lists) only when something inside them
+    changes, otherwise the original object is returned.
+
+    The kind of every type met is classified once with the ABCs and
+    cached, so later messages are dispatched on their exact type.
+
+    """
+    kinds = _kinds.setdefault(types, {})
+
+    def m(obj):
+        if primitive is not None and primitive(obj):
+            return f(obj)
+        t = type(obj)
+        try:
+            kind = kinds[t]
+        except KeyError:
+            kind = kinds[t] = _classify(t, types)
+        if kind == _LEAF:
+            return obj
+        if kind == _PRIMITIVE:
+            return f(obj)
+        if kind == _MAPPING:
+            new = None
+            for key, value in obj.items():
+                new_key = m(key)
+                new_value = m(value)
+                if new is not None:
+                    new[new_key] = new_value
+                elif new_key is not key or new_value is not value:
+                    # first change: copy the items seen so far
+                    new = {}
+                    for old_key, old_value in obj.items():
+                        if old_key is key:
+                            break
+                        new[old_key] = old_value
+                    new[new_key] = new_value
+            return obj if new is None else new
+        new = None
+        for i, value in enumerate(obj):
+            new_value = m(value)
+            if new is not None:
+                new.append(new_value)
+            elif new_value is not value:
+                # not every sequence can be sliced, e.g. deques
+                new = list(itertools.islice(obj, i))
+                new.append(new_value)
+        return obj if new is None else new
+
+    return m
+
+
 def dict_map(f, primitive, dic):
-    """Map a function f:{primitive} -> B to a dictionary."""
+    """Map a function f:{primitive} -> B to a dictionary.
+
+    Parts of `dic` without primitives are returned unchanged, not
+    copied.
+
+    """
+    return _mapper(f, primitive, ())(dic)
+
 
-    if primitive(dic):
-        return f(dic)
-    if isinstance(dic, Mapping):
-        return {dict_map(f, primitive, key): dict_map(f, primitive, value)
-                for key, value in dic.items()}
-    if isinstance(dic, str):
-        return dic
-    if isinstance(dic, Sequence):
-        return [dict_map(f, primitive, value) for value in dic]
-    return dic
+def type_map(f, types, dic):
+    """Like `dict_map`, with the instances of `types` as primitives."""
+    return _mapper(f, None, types)(dic)
 
 
 def actor_map(f, message):
-    def primitive(x):
-        return isinstance(x, Actor)
-    return dict_map(f, primitive, message)
+    return type_map(f, Actor, message)
@@ -0,0 +1,381 @@
+"""
+
+Wire protocol
+=============
+
+Framing and encoding of the messages exchanged by network runtimes.
+
+Every frame is a 4 bytes big endian length followed by the payload.
+The first frame of a connection is the handshake: the client sends
+the names of the codecs it accepts, separated by commas and in order
+of preference, and the server answers with the name of the first one
+it also knows.  All the following frames are encoded with that codec.
+
+Actor references travel as `ActorRef` objects.  Each codec decides how
+to encode them: `PickleCodec` pickles them natively, while
+`JSONCodec` uses the old ``{'_url': ..., '_uid': ...}`` form, adding
+``'_w'`` for the reference weight.
+
+`PickleOOBCodec` sends large buffers (``bytes``, ``bytearray``,
+contiguous ``memoryview`` and objects pickled with
+``pickle.PickleBuffer``, like NumPy arrays) out of band: its frame
+holds a table of sizes, the pickle stream and then the raw buffers,
+which are written without being copied into the stream.  The receiver
+rebuilds memoryviews and pickled buffers over the frame itself, so
+NumPy arrays share the receive buffer, while ``bytes`` and
+``bytearray`` are copied out of it and arrive with their own type.
+Small and non-contiguous memoryviews are copied, and arrive as
+byte-format memoryviews as well.
+Since they are not copied when sending, mutable buffers (``bytearray``,
+memoryviews, NumPy arrays...) must not be changed after the message is
+sent: the frame may be written later, when the connection is ready.
+
+`FrameReader` refuses frames larger than its `max_frame_size`, as the
+length of a frame is read from the peer before the frame itself.
+
+Note that `PickleCodec` and `PickleOOBCodec` must only be enabled
+between trusted peers: unpickling a frame can run arbitrary code.
+`network.NetworkRuntime` accepts only `JSONCodec` unless told
+otherwise.
+
+Exports
+-------
+
+- ``ActorRef``: marshalled reference to an actor
+- ``JSONCodec``, ``PickleCodec``, ``PickleOOBCodec``: the available
+  codecs
+- ``CODECS``: registry of codecs by name
+- ``frame``, ``frame_parts``, ``FrameReader``: framing helpers
+- ``FrameTooLarge``: raised by `FrameReader` for oversized frames
+- ``offer``, ``choose``: codec negotiation helpers
+
+"""
+
+from collections.abc import Mapping
+import io
+import json
+import pickle
+import struct
+
+
+HEADER = struct.Struct('>I')
+
+
+class ActorRef(object):
+    """Reference to the actor with `uid` living at `url`.
+
+    `weight` is the share of the reference count carried by this
+    reference (see the distributed garbage collection in `network`).
+    It does not take part in comparisons.
+
+    """
+
+    __slots__ = ('url', 'uid', 'weight')
+
+    def __init__(self, url, uid, weight=0):
+        self.url = url
+        self.uid = uid
+        self.weight = weight
+
+    def __reduce__(self):
+        return (ActorRef, (self.url, self.uid, self.weight))
+
+    def __eq__(self, other):
+        return (isinstance(other, ActorRef) and
+                self.url == other.url and self.uid == other.uid)
+
+    def __hash__(self):
+        return hash((self.url, self.uid))
+
+    def __repr__(self):
+        return 'ActorRef({!r}, {!r})'.format(self.url, self.uid)
+
+
+class AbstractCodec(object):
+
+    name = None
+
+    def encode(self, message):
+        raise NotImplementedError()
+
+    def encode_parts(self, message):
+        """Encode `message` as a list of buffers to be concatenated."""
+        return [self.encode(message)]
+
+    def decode(self, data):
+        raise NotImplementedError()
+
+
+class JSONCodec(AbstractCodec):
+
+    name = 'json'
+
+    def _default(self, obj):
+        if isinstance(obj, ActorRef):
+            if obj.weight:
+                return {'_url': obj.url, '_uid': obj.uid, '_w': obj.weight}
+            return {'_url': obj.url, '_uid': obj.uid}
+        if isinstance(obj, Mapping):
+            # e.g. a `runtime.Message` forwarded as is
+            return dict(obj)
+        raise TypeError('cannot encode {!r}'.format(obj))
+
+    def _object_hook(self, obj):
+        if '_url' in obj and '_uid' in obj:
+            n = len(obj)
+            if n == 2 or (n == 3 and '_w' in obj):
+                return ActorRef(obj['_url'], obj['_uid'], obj.get('_w', 0))
+        return obj
+
+    def encode(self, message):
+        return json.dumps(message, default=self._default).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(str(data, 'utf-8'), object_hook=self._object_hook)
+
+
+class _Pickler(pickle.Pickler):
+
+    def persistent_id(self, obj):
+        # encode references as a bare tuple, without the class path
+        if type(obj) is ActorRef:
+            return (obj.url, obj.uid, obj.weight)
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        return ActorRef(*pid)
+
+
+class PickleCodec(AbstractCodec):
+
+    name = 'pickle'
+
+    def encode(self, message):
+        buffer = io.BytesIO()
+        _Pickler(buffer, protocol=5).dump(message)
+        return buffer.getvalue()
+
+    def decode(self, data):
+        return _Unpickler(io.BytesIO(data)).load()
+
+
+class _OOBPickler(_Pickler):
+
+    def __init__(self, file, threshold, buffers):
+        super().__init__(file, protocol=5)
+        self.threshold = threshold
+        self.buffers = buffers
+
+    def persistent_id(self, obj):
+        # large buffers are replaced by their index in `buffers`, with
+        # their type for the ones copied on receive
+        t = type(obj)
+        kind = None
+        if t is bytes or t is bytearray:
+            size = len(obj)
+            kind = t.__name__
+        elif t is memoryview:
+            if not obj.c_contiguous:
+                obj = memoryview(obj.tobytes())
+            obj = obj.cast('B')
+            size = obj.nbytes
+        elif t is pickle.PickleBuffer:
+            obj = obj.raw()
+            size = obj.nbytes
+        else:
+            return super().persistent_id(obj)
+        if size < self.threshold:
+            if kind is None:
+                # views cannot be pickled: small ones are copied in-band
+                return ('memoryview', obj.tobytes())
+            return None
+        self.buffers.append(obj)
+        index = len(self.buffers) - 1
+        return index if kind is None else (kind, index)
+
+
+class _OOBUnpickler(_Unpickler):
+
+    types = {'bytes': bytes, 'bytearray': bytearray}
+
+    def __init__(self, file, buffers):
+        super().__init__(file)
+        self.buffers = buffers
+
+    def persistent_load(self, pid):
+        if type(pid) is int:
+            return self.buffers[pid]
+        if len(pid) == 2:
+            kind, index = pid
+            if kind == 'memoryview':
+                return memoryview(index)
+            return self.types[kind](self.buffers[index])
+        return super().persistent_load(pid)
+
+
+class PickleOOBCodec(AbstractCodec):
+    """Pickle codec passing buffers of `threshold` bytes or more out of
+    band (see the module documentation)."""
+
+    name = 'pickle-oob'
+
+    threshold = 1024 # bytes
+
+    COUNT = struct.Struct('>I')
+
+    def encode_parts(self, message):
+        buffers = []
+        stream = io.BytesIO()
+        _OOBPickler(stream, self.threshold, buffers).dump(message)
+        data = stream.getvalue()
+        sizes = [len(data)] + [len(buffer) for buffer in buffers]
+        table = (self.COUNT.pack(len(buffers)) +
+                 struct.pack('>{}Q'.format(len(sizes)), *sizes))
+        return [table, data] + buffers
+
+    def encode(self, message):
+        return b''.join(self.encode_parts(message))
+
+    def decode(self, data):
+        view = memoryview(data)
+        count, = self.COUNT.unpack_from(view)
+        offset = self.COUNT.size
+        sizes = struct.unpack_from('>{}Q'.format(count + 1), view, offset)
+        offset += 8 * (count + 1)
+        buffers = []
+        for size in sizes:
+            buffers.append(view[offset:offset + size])
+            offset += size
+        stream = buffers.pop(0)
+        return _OOBUnpickler(io.BytesIO(stream), buffers).load()
+
+
+CODECS = {codec.name: codec
+          for codec in (PickleOOBCodec(), PickleCodec(), JSONCodec())}
+
+
+def frame(payload):
+    """Prefix `payload` with its length."""
+    return HEADER.pack(len(payload)) + payload
+
+
+def frame_parts(parts):
+    """Prefix the payload made of the buffers `parts` with its length.
+
+    Return the list of buffers of the frame, without copying `parts`.
+
+    """
+    return [HEADER.pack(sum(len(part) for part in parts))] + parts
+
+
+class FrameTooLarge(ValueError):
+    """The length of a frame exceeds `FrameReader.max_frame_size`."""
+
+
+class FrameReader(object):
+    """Split a stream of bytes into frames.
+
+    Use as::
+
+        reader = FrameReader()
+        for payload in reader.feed(data):
+            ...
+
+    or, to read from a socket without copies, write into the buffer
+    returned by `get_buffer` and call `buffer_updated`.
+
+    The payloads are memoryviews over the receive buffer, which is
+    never reused: the bytes are read in chunks of `chunk_size`, and a
+    frame not fitting in what is left of the chunk gets a new buffer
+    of its own size.
+
+    A frame longer than `max_frame_size` bytes raises `FrameTooLarge`,
+    before any buffer is allocated for it.
+
+    """
+
+    chunk_size = 64 * 1024
+    max_frame_size = 64 * 1024 * 1024
+
+    def __init__(self):
+        self.buffer = bytearray(self.chunk_size)
+        # unparsed bytes are buffer[start:end]
+        self.start = 0
+        self.end = 0
+
+    def get_buffer(self, sizehint=-1):
+        """Return a writable view for the next bytes to read."""
+        buffer = self.buffer
+        start = self.start
+        pending = self.end - start
+        need = HEADER.size
+        if pending >= need:
+            need += self._check(HEADER.unpack_from(buffer, start)[0])
+        if start + need > len(buffer):
+            # the next frame does not fit: move it to a new buffer
+            new = bytearray(max(need, self.chunk_size))
+            new[:pending] = memoryview(buffer)[start:self.end]
+            buffer = self.buffer = new
+            self.start = 0
+            self.end = pending
+        return memoryview(buffer)[self.end:]
+
+    def buffer_updated(self, nbytes):
+        """Account for `nbytes` written to the view from `get_buffer`,
+        and return the list of completed payloads."""
+        self.end += nbytes
+        buffer = self.buffer
+        view = memoryview(buffer)
+        frames = []
+        start = self.start
+        end = self.end
+        while end - start >= HEADER.size:
+            size, = HEADER.unpack_from(buffer, start)
+            if size > self.max_frame_size and frames:
+                # return the frames before it, `get_buffer` raises next
+                break
+            stop = start + HEADER.size + self._check(size)
+            if stop > end:
+                break
+            frames.append(view[start + HEADER.size:stop])
+            start = stop
+        self.start = start
+        return frames
+
+    def _check(self, size):
+        if size > self.max_frame_size:
+            raise FrameTooLarge('frame of {} bytes, the limit is {}'
+                                .format(size, self.max_frame_size))
+        return size
+
+    def feed(self, data):
+        """Add `data` and return the list of completed payloads."""
+        data = memoryview(data).cast('B')
+        frames = []
+        while True:
+            target = self.get_buffer()
+            n = min(len(target), len(data))
+            target[:n] = data[:n]
+            frames.extend(self.buffer_updated(n))
+            data = data[n:]
+            if not data:
+                return frames
+
+
+def offer(names):
+    """Handshake frame offering the codecs `names`."""
+    return frame(','.join(names).encode('ascii'))
+
+
+def choose(offered, accepted):
+    """Pick the first codec in the `offered` handshake payload also
+    present in `accepted`, or ``None``.
+
+    """
+    for name in str(offered, 'ascii').split(','):
+        if name in accepted:
+            return name
+    return None